@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+"""
+Lense devtools benchmark suite.
+
+Generates synthetic Lense-style projects with Debian packaging, serves them
+from local bare repositories and runs the devtools build end to end in a
+throwaway workspace. Runs offline, no network access or root required.
+
+Scenarios:
+
+ cold:      Fresh workspace, clone and build every project
+ nochange:  Build again with no remote changes
+ small:     One small upstream commit to a single project
+ revisions: Many consecutive single commit revisions of a single project
+
+When <debuild> is not installed (or --stub-debuild is given) a stand-in that
+only writes an empty package is used, so the report measures the overhead of
+devtools itself rather than the package build.
+"""
+from __future__ import print_function
+import sys
+from json import dumps as json_dumps
+from time import time
+from tempfile import mkdtemp
+from shutil import rmtree
+from argparse import ArgumentParser
+from subprocess import check_call
+from distutils.spawn import find_executable
+from os import path, environ, makedirs, chmod, dup, dup2, open as os_open, close, fdopen, O_WRONLY, O_CREAT, O_APPEND
+
+# Repository root / devtools library / project attributes manifest
+REPO     = path.dirname(path.dirname(path.abspath(__file__)))
+LIBRARY  = '{0}/usr/lib/python2.7/dist-packages'.format(REPO)
+MANIFEST = '{0}/usr/share/lense_devtools/project.json'.format(REPO)
+
+# Synthetic projects: name / relative number of source files / dependencies
+PROJECTS = [
+    ('lense-common', 4, []),
+    ('lense-client', 1, ['lense-common']),
+    ('lense-engine', 2, ['lense-common']),
+    ('lense-portal', 3, ['lense-common']),
+    ('lense-socket', 1, ['lense-common'])
+]
+
+# Project version / branch
+VERSION = '0.1.1'
+BRANCH  = 'dev'
+
+# Stand-in for debuild, writes an empty package named after the changelog head
+STUB_DEBUILD = """#!/bin/sh
+set -e
+head=$(head -n 1 debian/changelog)
+name=${head%% *}
+version=$(echo "$head" | sed 's/^[^(]*(\\([^)]*\\)).*$/\\1/')
+: > "../${name}_${version}_all.deb"
+"""
+
+class DevToolsBenchmark(object):
+    """
+    Run the devtools build scenarios against synthetic projects.
+    """
+    def __init__(self, root, files=50, revisions=10, jobs=1, stub=False):
+        """
+        :param      root: The benchmark scratch directory
+        :type       root: str
+        :param     files: Source files per unit of project size
+        :type      files: int
+        :param revisions: Number of revisions for the revisions scenario
+        :type  revisions: int
+        :param      jobs: Number of projects to build in parallel
+        :type       jobs: int
+        :param      stub: Always use the debuild stand-in
+        :type       stub: bool
+        """
+        self.root      = root
+        self.files     = files
+        self.revisions = revisions
+        self.jobs      = jobs
+        self.stub      = stub or not find_executable('debuild')
+
+        # Bare remotes / upstream work trees / home directory with the workspace
+        self.remotes   = '{0}/remotes'.format(root)
+        self.upstream  = '{0}/upstream'.format(root)
+        self.home      = '{0}/home'.format(root)
+
+        # Scenario results
+        self.results   = []
+
+    def _git(self, cwd, *args):
+        """
+        Run a git command quietly.
+        """
+        check_call(['git'] + list(args), cwd=cwd, stdout=open('/dev/null', 'w'))
+
+    def _write(self, file, contents):
+        """
+        Write a file, creating its directory.
+        """
+        if not path.isdir(path.dirname(file)):
+            makedirs(path.dirname(file))
+        with open(file, 'w') as f:
+            f.write(contents)
+
+    def _environment(self):
+        """
+        Isolate git and devtools from the user's environment.
+        """
+        environ.update({
+            'HOME':                    self.home,
+            'GIT_CONFIG_NOSYSTEM':     '1',
+            'GIT_AUTHOR_NAME':         'Benchmark',
+            'GIT_AUTHOR_EMAIL':        'benchmark@localhost',
+            'GIT_COMMITTER_NAME':      'Benchmark',
+            'GIT_COMMITTER_EMAIL':     'benchmark@localhost',
+            'LENSE_DEVTOOLS_CONFIG':   '{0}/config.json'.format(self.root),
+            'LENSE_DEVTOOLS_MANIFEST': MANIFEST
+        })
+
+        # Debuild stand-in
+        if self.stub:
+            bindir = '{0}/bin'.format(self.root)
+            self._write('{0}/debuild'.format(bindir), STUB_DEBUILD)
+            chmod('{0}/debuild'.format(bindir), 0o755)
+            environ['PATH'] = '{0}:{1}'.format(bindir, environ.get('PATH', ''))
+
+    def _packaging(self, name, depends):
+        """
+        Return the Debian packaging files for a synthetic project.
+
+        :rtype: dict
+        """
+        return {
+            'debian/changelog': '{0} ({1}-dev0) trusty; urgency=low\n\n  * Initial release\n\n -- Benchmark <benchmark@localhost>  Thu, 01 Jan 2015 00:00:00 +0000\n'.format(name, VERSION),
+            'debian/compat': '9\n',
+            'debian/source/format': '3.0 (quilt)\n',
+            'debian/rules': '#!/usr/bin/make -f\n%:\n\tdh $@\n',
+            'debian/control': '\n'.join([
+                'Source: {0}'.format(name),
+                'Section: python',
+                'Priority: optional',
+                'Maintainer: Benchmark <benchmark@localhost>',
+                'Build-Depends: debhelper (>= 9)',
+                'Standards-Version: 3.9.5',
+                '',
+                'Package: {0}'.format(name),
+                'Architecture: all',
+                'Depends: ${{misc:Depends}}{0}'.format(''.join(', {0}'.format(d) for d in depends)),
+                'Description: Synthetic {0} benchmark package'.format(name),
+                ''
+            ])
+        }
+
+    def _source(self, name, size):
+        """
+        Return synthetic Python sources for a project.
+
+        :rtype: dict
+        """
+        module  = name.replace('-', '_')
+        sources = {'{0}/__init__.py'.format(module): '__version__ = "{0}"\n'.format(VERSION)}
+        for i in range(self.files * size):
+            sources['{0}/module_{1}/handler_{2}.py'.format(module, i % 10, i)] = ''.join(
+                'def handler_{0}_{1}(request):\n    return {{"handler": {0}, "step": {1}}}\n\n'.format(i, n) for n in range(40))
+        return sources
+
+    def create_projects(self):
+        """
+        Create an upstream work tree and a bare remote for every project.
+        """
+        for name, size, depends in PROJECTS:
+            work = '{0}/{1}'.format(self.upstream, name)
+            bare = '{0}/{1}.git'.format(self.remotes, name)
+            for f, contents in dict(self._packaging(name, depends), **self._source(name, size)).iteritems():
+                self._write('{0}/{1}'.format(work, f), contents)
+            chmod('{0}/debian/rules'.format(work), 0o755)
+
+            # Commit and publish to the bare remote
+            self._git(self.root, 'init', '-q', '--bare', bare)
+            self._git(work, 'init', '-q')
+            self._git(work, 'checkout', '-q', '-b', BRANCH)
+            self._git(work, 'add', '-A')
+            self._git(work, 'commit', '-q', '-m', 'Initial commit')
+            self._git(work, 'remote', 'add', 'origin', bare)
+            self._git(work, 'push', '-q', 'origin', BRANCH)
+
+    def create_config(self):
+        """
+        Write a devtools configuration pointing at the local remotes.
+        """
+        projects = {}
+        for name, size, depends in PROJECTS:
+            projects[name] = {
+                'git-remote': 'file://{0}/{1}.git'.format(self.remotes, name),
+                'git-branch': BRANCH,
+                'git-local':  'src/{0}'.format(name),
+                'version':    VERSION,
+                'depends':    depends
+            }
+        self._write(environ['LENSE_DEVTOOLS_CONFIG'], json_dumps({
+            'WORKSPACE': '.lense_devtools',
+            'DISABLED':  [],
+            'BUILD':     {'echo': False},
+            'PATCHES':   {'mode': 'git', 'rebase-bytes': 1048576},
+            'DAEMON':    {'socket': '{0}/devtools.sock'.format(self.root)},
+            'PROJECTS':  projects
+        }, indent=4))
+
+    def commit(self, name, n):
+        """
+        Push a small upstream change to a project.
+
+        :param name: The project name
+        :type  name: str
+        :param    n: A sequence number making the change unique
+        :type     n: int
+        """
+        work = '{0}/{1}'.format(self.upstream, name)
+        with open('{0}/{1}/__init__.py'.format(work, name.replace('-', '_')), 'a') as f:
+            f.write('CHANGE_{0} = {0}\n'.format(n))
+        self._git(work, 'commit', '-q', '-a', '-m', 'Change {0}'.format(n))
+        self._git(work, 'push', '-q', 'origin', BRANCH)
+
+    def run_scenario(self, interface, scenario, projects=None):
+        """
+        Run a build and record its phase timings.
+
+        :param interface: The devtools interface
+        :type  interface: DevToolsInterface
+        :param  scenario: The scenario name
+        :type   scenario: str
+        :param  projects: Projects to build, defaults to all
+        :type   projects: list
+        """
+        from lense_devtools.timing import DevToolsTimer
+        started = time()
+        status  = interface.run_job('build', projects or [p[0] for p in PROJECTS], {'auto': True, 'jobs': self.jobs, 'batch': False})
+        elapsed = round(time() - started, 4)
+        records = DevToolsTimer.records()
+
+        # Total wall time per phase across projects (phases may nest, pull includes fetch)
+        phases = {}
+        for r in records:
+            phases[r['phase']] = round(phases.get(r['phase'], 0) + r['wall'], 4)
+        self.results.append({
+            'scenario': scenario,
+            'ok':       all(status.values()),
+            'wall':     elapsed,
+            'phases':   phases,
+            'records':  records
+        })
+
+    def run(self):
+        """
+        Run all scenarios.
+        """
+        self._environment()
+        self.create_projects()
+        self.create_config()
+
+        # Import after the environment is set, the configuration path is read on import
+        sys.path.insert(0, LIBRARY)
+        sys.argv = ['lense-devtools', 'build', '--auto']
+        from lense_devtools.interface import DevToolsInterface
+        interface = DevToolsInterface()
+        interface._init_workspace()
+
+        # Cold clone / no changes / small change
+        self.run_scenario(interface, 'cold')
+        self.run_scenario(interface, 'nochange')
+        self.commit('lense-engine', 0)
+        self.run_scenario(interface, 'small', ['lense-engine'])
+
+        # Many revisions of one project
+        for n in range(1, self.revisions + 1):
+            self.commit('lense-client', n)
+            self.run_scenario(interface, 'revision-{0}'.format(n), ['lense-client'])
+
+    def table(self):
+        """
+        Return the results table lines, one row per scenario.
+
+        :rtype: list
+        """
+        phases = sorted(set(p for r in self.results for p in r['phases']))
+        lines  = ['{0:<14} {1:<4} {2}'.format('SCENARIO', 'OK', ' '.join('{0:>10}'.format(p) for p in phases + ['total']))]
+        for r in self.results:
+            values = [r['phases'].get(p) for p in phases] + [r['wall']]
+            lines.append('{0:<14} {1:<4} {2}'.format(r['scenario'], 'yes' if r['ok'] else 'no', ' '.join('{0:>10}'.format('-' if v is None else '{0:.3f}'.format(v)) for v in values)))
+        return lines
+
+def main():
+    parser = ArgumentParser(description='Benchmark the devtools build pipeline against synthetic projects')
+    parser.add_argument('-f', '--files', help='Source files per unit of project size', type=int, default=50)
+    parser.add_argument('-r', '--revisions', help='Number of revisions for the revisions scenario', type=int, default=10)
+    parser.add_argument('-j', '--jobs', help='Number of projects to build in parallel', type=int, default=1)
+    parser.add_argument('-o', '--output', help='Write the JSON results to this file')
+    parser.add_argument('-k', '--keep', help='Keep the scratch directory', action='store_true')
+    parser.add_argument('-v', '--verbose', help='Show devtools output', action='store_true')
+    parser.add_argument('--stub-debuild', help='Use the debuild stand-in even if debuild is installed', action='store_true')
+    args = parser.parse_args()
+
+    root  = mkdtemp(prefix='lense-devtools-bench-')
+    bench = DevToolsBenchmark(root, files=args.files, revisions=args.revisions, jobs=args.jobs, stub=args.stub_debuild)
+
+    # Send devtools output to a log unless verbose
+    console = fdopen(dup(1), 'w')
+    if not args.verbose:
+        log = os_open('{0}/benchmark.log'.format(root), O_WRONLY | O_CREAT | O_APPEND, 0o644)
+        dup2(log, 1)
+        dup2(log, 2)
+        close(log)
+    try:
+        bench.run()
+    finally:
+        sys.stdout.flush()
+        console.write('\n'.join(['', 'debuild: {0}'.format('stand-in' if bench.stub else 'installed'), 'scratch: {0}'.format(root), ''] + bench.table() + ['']))
+        console.flush()
+
+        # Save the results
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(json_dumps({'debuild': 'stand-in' if bench.stub else 'installed', 'results': bench.results}, indent=2))
+        if not args.keep:
+            rmtree(root, ignore_errors=True)
+    return 0 if all(r['ok'] for r in bench.results) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
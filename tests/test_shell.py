@@ -0,0 +1,24 @@
+import unittest
+from time import time
+from lense_devtools.common import DevToolsCommon
+
+class TestShellTimeout(unittest.TestCase):
+    """
+    Timed out commands are killed along with the processes they started.
+    """
+    def setUp(self):
+        self.common = DevToolsCommon.__new__(DevToolsCommon)
+
+    def test_kills_grandchildren(self):
+        start     = time()
+        code, err = self.common.shell(['sh', '-c', 'sleep 8; echo done'], timeout=1)
+        self.assertEqual(code, -9)
+        self.assertIn('Command timed out after 1 seconds', err)
+        self.assertLess(time() - start, 4)
+
+    def test_captures_output(self):
+        code, out, err = self.common.shell(['sh', '-c', 'echo out; echo err >&2'], stdout=True, timeout=5)
+        self.assertEqual((code, out, err), (0, 'out\n', 'err\n'))
+
+if __name__ == '__main__':
+    unittest.main()
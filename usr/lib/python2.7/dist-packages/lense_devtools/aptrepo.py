@@ -0,0 +1,199 @@
+from gzip import GzipFile
+from os import path, rename
+from hashlib import md5, sha1, sha256
+from email.utils import formatdate
+from fcntl import flock, LOCK_EX, LOCK_UN
+from lense_devtools.common import DevToolsCommon
+
+class DevToolsAptRepo(DevToolsCommon):
+    """
+    Flat APT repository kept next to the build output. Each published package
+    is appended to the index, existing packages are never rescanned.
+    """
+    def __init__(self, broot):
+        """
+        :param broot: The build output directory
+        :type  broot: str
+        """
+        super(DevToolsAptRepo, self).__init__()
+
+        # Repository settings
+        settings      = self.config.get('APT_REPO', {})
+        self.enabled  = settings.get('enabled', True)
+        self.origin   = settings.get('origin', 'Lense')
+        self.suite    = settings.get('suite', 'trusty')
+
+        # Repository root / pool / index files
+        self.root     = '{0}/repo'.format(broot)
+        self.pool     = '{0}/pool'.format(self.root)
+        self.packages = '{0}/Packages'.format(self.root)
+        self.release  = '{0}/Release'.format(self.root)
+        self.lockfile = '{0}/.lock'.format(self.root)
+
+    def source(self):
+        """
+        Return the APT sources line for the repository.
+
+        :rtype: str
+        """
+        return 'deb [trusted=yes] file://{0} ./'.format(self.root)
+
+    def _digests(self, file):
+        """
+        Return the size and MD5/SHA1/SHA256 digests of a file in one read.
+
+        :param file: The file to hash
+        :type  file: str
+        :rtype: tuple
+        """
+        hashes = [md5(), sha1(), sha256()]
+        size   = 0
+        with open(file, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                size += len(chunk)
+                for h in hashes:
+                    h.update(chunk)
+        return tuple([size] + [h.hexdigest() for h in hashes])
+
+    def _indexed(self, filename):
+        """
+        Check if a pool file is already in the index.
+
+        :param filename: The pool relative file name
+        :type  filename: str
+        :rtype: bool
+        """
+        if not path.isfile(self.packages):
+            return False
+        needle = 'Filename: {0}\n'.format(filename)
+        with open(self.packages, 'r') as f:
+            for line in f:
+                if line == needle:
+                    return True
+        return False
+
+    def _stanza(self, debpath, filename):
+        """
+        Generate the index stanza for a package.
+
+        :param  debpath: The package
+        :type   debpath: str
+        :param filename: The pool relative file name
+        :type  filename: str
+        :rtype: str|None
+        """
+        code, out, err = self.shell(['dpkg-deb', '-f', debpath], stdout=True)
+        if not code == 0 or not out.strip():
+            self.feedback.info('Could not read control fields from <{0}>, not indexed: {1}'.format(debpath, err.strip()))
+            return None
+        size, md5sum, sha1sum, sha256sum = self._digests(debpath)
+        return '{0}\nFilename: {1}\nSize: {2}\nMD5sum: {3}\nSHA1: {4}\nSHA256: {5}\n\n'.format(
+            out.rstrip('\n'), filename, size, md5sum, sha1sum, sha256sum
+        )
+
+    def _write_release(self):
+        """
+        Write the Release file for the current index files.
+        """
+        files = []
+        for name in ['Packages', 'Packages.gz']:
+            files.append((name,) + self._digests('{0}/{1}'.format(self.root, name)))
+
+        # Header and checksums of each index file
+        lines = [
+            'Origin: {0}'.format(self.origin),
+            'Label: {0}'.format(self.origin),
+            'Suite: {0}'.format(self.suite),
+            'Codename: {0}'.format(self.suite),
+            'Date: {0}'.format(formatdate(usegmt=True)),
+            'Architectures: all'
+        ]
+        for field, index in [('MD5Sum', 2), ('SHA1', 3), ('SHA256', 4)]:
+            lines.append('{0}:'.format(field))
+            for f in files:
+                lines.append(' {0} {1} {2}'.format(f[index], f[1], f[0]))
+
+        # Replace the Release file in one step
+        tmp = '{0}.tmp'.format(self.release)
+        with open(tmp, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        rename(tmp, self.release)
+
+    def add(self, debpath):
+        """
+        Link a package into the pool and append it to the index.
+
+        :param debpath: The package
+        :type  debpath: str
+        :rtype: bool
+        """
+        if not self.enabled:
+            return False
+        debname  = path.basename(debpath)
+        project  = debname.split('_')[0]
+        filename = 'pool/{0}/{1}'.format(project, debname)
+
+        # One writer at a time, builds may run in parallel
+        self.mkdir(self.root)
+        lock = open(self.lockfile, 'a')
+        flock(lock.fileno(), LOCK_EX)
+        try:
+            if self._indexed(filename):
+                return False
+            stanza = self._stanza(debpath, filename)
+            if not stanza:
+                return False
+            self.mkdir('{0}/{1}'.format(self.pool, project))
+            self.linkfile(debpath, '{0}/{1}'.format(self.root, filename))
+
+            # Append to the plain index and as a new gzip member to the compressed index
+            with open(self.packages, 'a') as f:
+                f.write(stanza)
+            gz = GzipFile('{0}.gz'.format(self.packages), 'ab')
+            try:
+                gz.write(stanza)
+            finally:
+                gz.close()
+            self._write_release()
+        finally:
+            flock(lock.fileno(), LOCK_UN)
+            lock.close()
+        self.feedback.info('Indexed {0} in APT repository: {1}'.format(debname, self.source()))
+        return True
+
+    def drop(self, filenames):
+        """
+        Remove the index stanzas of packages taken out of the pool.
+
+        :param filenames: The pool relative file names
+        :type  filenames: list
+        :rtype: int
+        """
+        if not path.isfile(self.packages):
+            return 0
+        needles = set('Filename: {0}\n'.format(f) for f in filenames)
+
+        # One writer at a time, rewrite both index files in full
+        lock = open(self.lockfile, 'a')
+        flock(lock.fileno(), LOCK_EX)
+        try:
+            with open(self.packages, 'r') as f:
+                stanzas = [s + '\n\n' for s in f.read().split('\n\n') if s.strip()]
+            kept = [s for s in stanzas if not [n for n in needles if n in s]]
+            if len(kept) == len(stanzas):
+                return 0
+            tmp = '{0}.tmp'.format(self.packages)
+            with open(tmp, 'w') as f:
+                f.write(''.join(kept))
+            rename(tmp, self.packages)
+            gz = GzipFile('{0}.gz.tmp'.format(self.packages), 'wb')
+            try:
+                gz.write(''.join(kept))
+            finally:
+                gz.close()
+            rename('{0}.gz.tmp'.format(self.packages), '{0}.gz'.format(self.packages))
+            self._write_release()
+        finally:
+            flock(lock.fileno(), LOCK_UN)
+            lock.close()
+        return len(stanzas) - len(kept)
@@ -29,8 +29,12 @@ class DevToolsArgs(object):
         :rtype: str
         """
         return ("build:   Build all/specific projects in the current workspace\n"
+                "export:  Export the current packages as one consistent snapshot directory\n"
+                "gc:      Remove old builds, source tarballs and by-products per the retention policy\n"
                 "install: Install or upgrade all/specific projects in the current builds directory\n"
-                "list:    List all configured projects and attributes")
+                "list:    List all configured projects and attributes\n"
+                "serve:   Run a daemon accepting build/install jobs on a local socket\n"
+                "watch:   Poll project remotes and build projects whose branch moved")
         
     def _desc(self):
         """
@@ -44,7 +48,7 @@ class DevToolsArgs(object):
         """
         Perform argument validation.
         """
-        commands = ['build', 'install', 'list']
+        commands = ['build', 'export', 'gc', 'install', 'list', 'serve', 'watch']
         
         # Make sure the command is valid
         if not self.get('command') in commands:
@@ -66,6 +70,10 @@ class DevToolsArgs(object):
         # Argument flags
         self.parser.add_argument('-p', '--projects', help='A single project or comma seperated list of projects', action='append')
         self.parser.add_argument('-a', '--auto', help='Run in automated mode (avoid prompts)', action='store_true')
+        self.parser.add_argument('-b', '--batch', help='Install all packages in a single dpkg transaction', action='store_true')
+        self.parser.add_argument('-d', '--daemon', help='Submit the build/install job to a running daemon', action='store_true')
+        self.parser.add_argument('-o', '--output', help='Snapshot directory for the export command')
+        self.parser.add_argument('-j', '--jobs', help='Number of projects to build in parallel (implies --auto)', type=int, default=1)
         
         # Parse arguments
         argv.pop(0)
@@ -0,0 +1,180 @@
+from time import time
+from hashlib import sha1
+from shutil import rmtree
+from json import dumps as json_dumps, loads as json_loads
+from os import path, listdir, utime, walk, readlink
+from lense_devtools.common import DevToolsCommon
+
+class DevToolsArtifactCache(DevToolsCommon):
+    """
+    Content addressed cache of built packages, keyed by project, commit,
+    version and build inputs.
+    """
+    def __init__(self, project, attrs, commit, branch=None):
+        """
+        :param project: The project name
+        :type  project: str
+        :param   attrs: Project attributes
+        :type    attrs: dict
+        :param  commit: The commit SHA of the source tree
+        :type   commit: str
+        :param  branch: The branch being built
+        :type   branch: str
+        """
+        super(DevToolsArtifactCache, self).__init__()
+
+        # Project name / commit / branch / version
+        self.name    = project
+        self.commit  = commit
+        self.branch  = branch or attrs.get('git-branch')
+        self.version = attrs.get('version')
+
+        # Cache settings (0 means no limit) / cache root
+        settings     = self.config.get('ARTIFACT_CACHE', {})
+        self.maxsize = int(settings.get('max-size-mb', 2048)) * 1024 * 1024
+        self.maxage  = int(settings.get('max-age-days', 30)) * 86400
+        self.cdir    = self.mkdir('{0}/cache/artifacts'.format(self.workspace))
+
+        # Cache key / entry directory
+        self.key     = None if not commit else self._key(attrs)
+        self.edir    = None if not self.key else '{0}/{1}'.format(self.cdir, self.key)
+
+    def _key(self, attrs):
+        """
+        Generate the cache key for the current build inputs, including the
+        target distribution and build backend.
+
+        :rtype: str
+        """
+        build = self.config.get('BUILD', {})
+        return sha1(json_dumps({
+            'project': self.name,
+            'commit':  self.commit,
+            'branch':  self.branch,
+            'version': self.version,
+            'attrs':   attrs,
+            'dist':    build.get('distribution', 'trusty'),
+            'backend': build.get('backend', 'host')
+        }, sort_keys=True)).hexdigest()
+
+    def _meta(self, edir):
+        """
+        Load the metadata for a cache entry.
+
+        :rtype: dict|None
+        """
+        try:
+            with open('{0}/meta.json'.format(edir), 'r') as f:
+                return json_loads(f.read())
+        except (IOError, ValueError):
+            return None
+
+    def lookup(self):
+        """
+        Return the path to a cached package for the current inputs.
+
+        :rtype: str|None
+        """
+        if not self.edir:
+            return None
+        meta = self._meta(self.edir)
+        if not meta:
+            return None
+
+        # Make sure the package is still present
+        debpath = '{0}/{1}'.format(self.edir, meta['deb'])
+        if not path.isfile(debpath):
+            return None
+
+        # Mark the entry as recently used
+        utime('{0}/meta.json'.format(self.edir), None)
+        return debpath
+
+    def store(self, debpath):
+        """
+        Store a built package in the cache.
+
+        :param debpath: The package to store
+        :type  debpath: str
+        """
+        if not self.edir:
+            return None
+        self.mkdir(self.edir)
+        debname = path.basename(debpath)
+        target  = '{0}/{1}'.format(self.edir, debname)
+
+        # Hardlink or reflink when possible, otherwise copy
+        self.linkfile(debpath, target)
+
+        # Replace the package of an earlier build of the same inputs
+        for f in listdir(self.edir):
+            if f.endswith('.deb') and not f == debname:
+                self.rmfile('{0}/{1}'.format(self.edir, f))
+
+        # Write the entry metadata
+        with open('{0}/meta.json'.format(self.edir), 'w') as f:
+            f.write(json_dumps({
+                'project': self.name,
+                'commit':  self.commit,
+                'branch':  self.branch,
+                'version': self.version,
+                'deb':     debname,
+                'created': int(time())
+            }))
+        self.feedback.info('Cached build artifact: {0}'.format(self.key))
+        self.evict()
+
+    def _referenced(self):
+        """
+        Return a set of cache entries referenced by build links.
+
+        :rtype: set
+        """
+        entries = set()
+        for root, dirs, files in walk('{0}/build'.format(self.workspace)):
+            for f in files:
+                fpath = path.join(root, f)
+                if path.islink(fpath):
+                    target = readlink(fpath)
+                    if target.startswith(self.cdir):
+                        entries.add(target[len(self.cdir):].strip('/').split('/')[0])
+        return entries
+
+    def _size(self, edir):
+        """
+        Return the size in bytes of a cache entry.
+
+        :rtype: int
+        """
+        return sum(path.getsize(path.join(edir, f)) for f in listdir(edir))
+
+    def evict(self):
+        """
+        Remove expired entries, then least recently used entries until the
+        cache fits its size limit. Entries in use by current builds are kept,
+        a limit of 0 is not enforced.
+        """
+        now        = time()
+        referenced = self._referenced()
+        entries    = []
+        for key in listdir(self.cdir):
+            edir = '{0}/{1}'.format(self.cdir, key)
+            if not path.isdir(edir):
+                continue
+            meta  = '{0}/meta.json'.format(edir)
+            atime = path.getmtime(meta) if path.isfile(meta) else 0
+            entries.append((atime, key, edir, self._size(edir)))
+
+        # Oldest entries first
+        entries.sort()
+        total   = sum(e[3] for e in entries)
+        evicted = 0
+        for atime, key, edir, size in entries:
+            if key in referenced:
+                continue
+            if (self.maxage and (now - atime) > self.maxage) or (self.maxsize and total > self.maxsize):
+                rmtree(edir, ignore_errors=True)
+                total   -= size
+                evicted += 1
+        if evicted:
+            self.feedback.info('Evicted {0} cached build artifact(s)'.format(evicted))
@@ -0,0 +1,162 @@
+from shutil import rmtree
+from itertools import count
+from threading import Lock
+from contextlib import contextmanager
+from fcntl import flock, LOCK_EX, LOCK_UN
+from distutils.spawn import find_executable
+from os import path, rename, rmdir, getpid, geteuid
+from lense_devtools.common import DevToolsCommon
+
+# Packages every base root filesystem needs to build Lense projects
+BASE_PACKAGES = ['build-essential', 'devscripts', 'debhelper', 'equivs', 'fakeroot', 'python']
+
+class DevToolsBuildRoot(DevToolsCommon):
+    """
+    Isolated build roots: a prepared base root filesystem per distribution,
+    with a throwaway copy-on-write overlay instance for every build.
+    """
+
+    # Instance counter shared by parallel builds in this process
+    _ids  = count()
+    _lock = Lock()
+
+    def __init__(self, distribution):
+        """
+        :param distribution: The distribution codename (e.g. trusty)
+        :type  distribution: str
+        """
+        super(DevToolsBuildRoot, self).__init__()
+
+        # Isolation settings
+        settings          = self.config.get('ISOLATION', {})
+        self.distribution = distribution
+        self.mirror       = settings.get('mirror', 'http://archive.ubuntu.com/ubuntu')
+        self.packages     = BASE_PACKAGES + list(settings.get('packages', []))
+
+        # Base root filesystem / overlay instances
+        self.droot        = '{0}/buildroots/{1}'.format(self.workspace, distribution)
+        self.base         = '{0}/base'.format(self.droot)
+        self.instances    = '{0}/instances'.format(self.droot)
+
+    def _run(self, cmd):
+        """
+        Run a setup command, failing the build on errors.
+
+        :param cmd: The command to run
+        :type  cmd: list
+        """
+        code, err = self.shell(cmd)
+        if not code == 0:
+            raise Exception('Command <{0}> failed: {1}'.format(' '.join(cmd), err.strip()))
+
+    def prepare(self):
+        """
+        Create the base root filesystem for the distribution once. Concurrent
+        builds wait for the first one to finish preparing it.
+
+        :rtype: str
+        """
+        if path.isdir(self.base):
+            return self.base
+        if not geteuid() == 0:
+            raise Exception('Isolated builds must be run as superuser')
+        if not find_executable('debootstrap'):
+            raise Exception('Isolated builds require the "debootstrap" command')
+
+        # One process prepares the base, staged until complete
+        self.mkdir(self.droot)
+        lock = open('{0}/.lock'.format(self.droot), 'a')
+        flock(lock.fileno(), LOCK_EX)
+        try:
+            if not path.isdir(self.base):
+                staging = '{0}.partial'.format(self.base)
+                rmtree(staging, ignore_errors=True)
+                self.feedback.info('Preparing {0} base root filesystem: {1}'.format(self.distribution, self.base))
+                self._run(['debootstrap', '--variant=buildd', '--include={0}'.format(','.join(self.packages)), self.distribution, staging, self.mirror])
+                rename(staging, self.base)
+                self.feedback.success('Prepared {0} base root filesystem'.format(self.distribution))
+        finally:
+            flock(lock.fileno(), LOCK_UN)
+            lock.close()
+        return self.base
+
+    @contextmanager
+    def instance(self, label, root):
+        """
+        Mount an overlay instance of the base root filesystem with a project
+        root bound to /build, removing it afterwards.
+
+        :param label: The build target label
+        :type  label: str
+        :param  root: The project root to bind into the instance
+        :type   root: str
+        """
+        base = self.prepare()
+        with self._lock:
+            iid = next(self._ids)
+        idir    = '{0}/{1}-{2}-{3}'.format(self.instances, label.replace('/', '_'), getpid(), iid)
+        upper   = self.mkdir('{0}/upper'.format(idir))
+        work    = self.mkdir('{0}/work'.format(idir))
+        merged  = self.mkdir('{0}/merged'.format(idir))
+        mounts  = []
+        try:
+            self._run(['mount', '-t', 'overlay', 'overlay', '-o', 'lowerdir={0},upperdir={1},workdir={2}'.format(base, upper, work), merged])
+            mounts.append(merged)
+            for cmd, target in [
+                (['mount', '-t', 'proc', 'proc'], 'proc'),
+                (['mount', '--bind', '/dev'], 'dev'),
+                (['mount', '--bind', root], 'build')
+            ]:
+                target = self.mkdir('{0}/{1}'.format(merged, target))
+                self._run(cmd + [target])
+                mounts.append(target)
+            yield merged
+
+        # Unmount in reverse order and throw the instance away
+        finally:
+            self._teardown(idir, mounts)
+
+    def _teardown(self, idir, mounts):
+        """
+        Unmount an instance and remove its overlay layers. Nothing is removed
+        while any mount is still in place, the bind mounts are the host's
+        /dev and the project root.
+
+        :param   idir: The instance directory
+        :type    idir: str
+        :param mounts: The mounted targets, in mount order
+        :type  mounts: list
+        """
+        failed = []
+        for target in reversed(mounts):
+            code, err = self.shell(['umount', target])
+            if not code == 0 or path.ismount(target):
+                failed.append(target)
+                self.feedback.error('Failed to unmount <{0}>: {1}'.format(target, err.strip()))
+        if failed:
+            self.feedback.error('Leaving isolated build instance in place: {0}'.format(idir))
+            return False
+
+        # Only the overlay layers hold instance data, the mount points are empty
+        for layer in ['upper', 'work']:
+            rmtree('{0}/{1}'.format(idir, layer), ignore_errors=True)
+        for target in ['{0}/merged'.format(idir), idir]:
+            try:
+                rmdir(target)
+            except OSError:
+                pass
+        return True
+
+    def command(self, merged, src, cmd):
+        """
+        Return a command running in a project source directory of an instance.
+
+        :param merged: The mounted instance root
+        :type  merged: str
+        :param    src: The project source directory name under /build
+        :type     src: str
+        :param    cmd: The shell command line
+        :type     cmd: str
+        :rtype: list
+        """
+        return ['chroot', merged, '/bin/sh', '-c', 'cd /build/{0} && {1}'.format(src, cmd)]
@@ -0,0 +1,85 @@
+from re import compile
+from tempfile import mkstemp
+from shutil import copymode
+from os import path, fdopen, fsync, rename, unlink, chmod
+
+# Changelog entry header: <package> (<version>) <distribution>; <options>
+ENTRY_HEADER = compile(r'^\S+ \(([^)]+)\) ')
+
+# Development revision versions: <version>-dev<number>
+DEV_VERSION  = compile(r'-dev[0-9]+$')
+
+class DevToolsChangelog(object):
+    """
+    Prepend entries to a Debian changelog without loading it into memory.
+    """
+    def __init__(self, chlog, keep=0):
+        """
+        :param chlog: The changelog path
+        :type  chlog: str
+        :param  keep: Maximum number of development entries to keep, 0 for all
+        :type   keep: int
+        """
+        self.chlog = chlog
+        self.keep  = int(keep or 0)
+
+    def _copy(self, src, dst):
+        """
+        Stream existing entries from one file to another, dropping
+        development entries past the configured limit. The new entry
+        already written counts towards the limit.
+
+        :param src: The existing changelog
+        :type  src: file
+        :param dst: The new changelog
+        :type  dst: file
+        :rtype: int
+        """
+        dev_entries = 1
+        dropped     = 0
+        skip        = False
+        for line in src:
+            header = ENTRY_HEADER.match(line)
+            if header:
+                skip = False
+                if DEV_VERSION.search(header.group(1)):
+                    dev_entries += 1
+                    if self.keep and dev_entries > self.keep:
+                        skip     = True
+                        dropped += 1
+            if not skip:
+                dst.write(line)
+        return dropped
+
+    def prepend(self, entry):
+        """
+        Write a new entry at the top of the changelog. The new file is built
+        next to the old one and renamed over it.
+
+        :param entry: The changelog entry
+        :type  entry: str
+        :rtype: int
+        """
+        fd, tmp = mkstemp(prefix='.changelog.', dir=path.dirname(self.chlog))
+        dropped = 0
+        try:
+            with fdopen(fd, 'w') as dst:
+                dst.write('{0}\n\n'.format(entry))
+
+                # Stream the existing entries
+                if path.isfile(self.chlog):
+                    with open(self.chlog, 'r') as src:
+                        dropped = self._copy(src, dst)
+                    copymode(self.chlog, tmp)
+                else:
+                    chmod(tmp, 0o644)
+                dst.flush()
+                fsync(dst.fileno())
+
+            # Atomically replace the changelog
+            rename(tmp, self.chlog)
+        except:
+            if path.isfile(tmp):
+                unlink(tmp)
+            raise
+        return dropped
@@ -0,0 +1,110 @@
+from os import path, rename, unlink
+from json import dumps as json_dumps, loads as json_loads
+
+class DevToolsCheckpoint(object):
+    """
+    Build pipeline checkpoint for a project, stored in the project root. A
+    failed or interrupted build leaves its revision and completed stages
+    behind so the next run resumes where it stopped.
+    """
+    def __init__(self, root):
+        """
+        :param root: The project root directory
+        :type  root: str
+        """
+        self.file  = '{0}/checkpoint.json'.format(root)
+        self.state = self._load()
+
+    def _load(self):
+        """
+        Load the checkpoint state.
+
+        :rtype: dict|None
+        """
+        try:
+            with open(self.file, 'r') as f:
+                return json_loads(f.read())
+        except (IOError, ValueError):
+            return None
+
+    def _save(self):
+        """
+        Replace the checkpoint file in one step.
+        """
+        tmp = '{0}.tmp'.format(self.file)
+        with open(tmp, 'w') as f:
+            f.write(json_dumps(self.state))
+        rename(tmp, self.file)
+
+    def pending(self):
+        """
+        Check if an unfinished build is recorded.
+
+        :rtype: bool
+        """
+        return bool(self.state)
+
+    @property
+    def revision(self):
+        """
+        Return the revision of the unfinished build.
+
+        :rtype: str|None
+        """
+        return None if not self.state else self.state['revision']
+
+    def start(self, revision, commit):
+        """
+        Start recording a build.
+
+        :param revision: The revision being built
+        :type  revision: str
+        :param   commit: The commit SHA being built
+        :type    commit: str
+        """
+        self.state = {'revision': revision, 'commit': commit, 'stages': []}
+        self._save()
+
+    def resume(self, commit):
+        """
+        Resume an unfinished build. When the source moved to another commit
+        only the changelog entry for the revision is kept.
+
+        :param commit: The commit SHA being built
+        :type  commit: str
+        :rtype: list
+        """
+        if not self.state['commit'] == commit:
+            self.state['commit'] = commit
+            self.state['stages'] = [s for s in self.state['stages'] if s == 'changelog']
+            self._save()
+        return self.state['stages']
+
+    def done(self, stage):
+        """
+        Check if a stage has completed.
+
+        :param stage: The stage name
+        :type  stage: str
+        :rtype: bool
+        """
+        return bool(self.state) and stage in self.state['stages']
+
+    def complete(self, stage):
+        """
+        Record a stage as completed.
+
+        :param stage: The stage name
+        :type  stage: str
+        """
+        if not stage in self.state['stages']:
+            self.state['stages'].append(stage)
+            self._save()
+
+    def clear(self):
+        """
+        Remove the checkpoint once the build has finished.
+        """
+        self.state = None
+        if path.isfile(self.file):
+            unlink(self.file)
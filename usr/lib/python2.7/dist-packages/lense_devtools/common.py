@@ -1,10 +1,22 @@
-import tarfile
-from sys import exit
+from sys import exit, stdout as console_out, stderr as console_err
+from errno import EEXIST, EXDEV
+from fcntl import ioctl
 from feedback import Feedback
+from collections import deque
 from subprocess import Popen, PIPE
-from json import loads as json_loads
-from shutil import move as move_file
-from os import path, makedirs, unlink, symlink, chdir, getcwd
+from signal import SIGKILL
+from threading import Thread, Timer, Lock, Event, current_thread
+from shutil import move as move_file, copy2, copystat
+from os import path, makedirs, unlink, symlink, rename, link, getpid, setsid, killpg
+from lense_devtools.tarball import DevToolsTarball
+from lense_devtools.treeindex import DevToolsTreeIndex
+from lense_devtools.config import DevToolsConfig, DevToolsConfigError
+
+# ioctl cloning a whole file (copy-on-write filesystems such as btrfs/XFS)
+FICLONE = 0x40049409
+
+# Seconds to wait for output pipes once a timed out command was killed
+KILL_GRACE = 2
 
 class DevToolsCommon(object):
     """
@@ -13,76 +25,80 @@ class DevToolsCommon(object):
     def __init__(self):
         self.feedback  = Feedback()
         
+        # Shared configuration (loaded once per process, reloaded on change)
+        try:
+            self._config = DevToolsConfig.get()
+        except DevToolsConfigError as e:
+            self.die(str(e))
+        
         # Configuration / workspace / projects / disabled projects
-        self.config    = self._get_config()
-        self.workspace = self._get_workspace()
-        self.projects  = self._get_projects()
-        self.disabled  = self._get_disabled()
+        self.config    = self._config.config
+        self.workspace = self._config.workspace
+        self.projects  = self._config.projects
+        self.disabled  = self._config.disabled
         
-    def _get_config(self):
+    def project_root(self, project, attrs, branch=None):
         """
-        Look for a configuration at: /etc/lense_devtools/config.json
+        Return the root directory of a project build target. Branches other
+        than the configured <git-branch> get their own root.
         
-        :rtype: dict
+        :param project: The project name
+        :type  project: str
+        :param   attrs: Project attributes
+        :type    attrs: dict
+        :param  branch: The branch being built
+        :type   branch: str
+        :rtype: str
         """
-        config = '/etc/lense_devtools/config.json'
-        if not path.isfile(config):
-            raise Exception('Configuration file missing: <{0}> not found'.format(config))
-        
-        try:
-            return json_loads(open(config, 'r').read())
-        except Exception as e:
-            self.die('Failed to parse <{0}>: {1}'.format(config, str(e.message)))
+        root = '{0}/{1}'.format(self.workspace, attrs.get('git-local', 'src/{0}'.format(project)))
+        if branch and not branch == attrs.get('git-branch'):
+            root = '{0}/branches/{1}'.format(root, branch.replace('/', '_'))
+        return root
         
-    def _get_disabled(self):
+    def build_root(self, attrs, branch=None):
         """
-        Return a list of disable projects.
-        """
-        return {} if not 'DISABLED' in self.config else self.config['DISABLED']
+        Return the build output directory of a build target.
         
-    def _get_projects(self):
+        :param  attrs: Project attributes
+        :type   attrs: dict
+        :param branch: The branch being built
+        :type  branch: str
+        :rtype: str
         """
-        Retrieve a dict of configured projects.
+        if branch and not branch == attrs.get('git-branch'):
+            return '{0}/build/{1}'.format(self.workspace, branch.replace('/', '_'))
+        return '{0}/build'.format(self.workspace)
         
-        :rtype: dict
+    def tree_index(self, project, attrs, branch=None):
         """
-        if not 'PROJECTS' in self.config:
-            self.die('Missing required <PROJECTS> key in: {0}'.format(self.config))
-        
-        # Projects must be a dict
-        if not isinstance(self.config['PROJECTS'], dict):
-            self.die('Required key <PROJECTS> must be a dict'.format(self.config))
-        
-        # Project validation manifest
-        vattrs = '/usr/share/lense_devtools/project.json'
-        
-        # Try to load the validation manifest
-        if not path.isfile(vattrs):
-            self.die('Could not locate project attributes manifest: {0}'.format(vattrs))
-        vattrs = json_loads(open(vattrs, 'r').read())
+        Return the source tree index of a build target, or None if local
+        change detection is disabled by the <TREE_INDEX> key.
         
-        # Validate projects
-        for pk,pa in self.config['PROJECTS'].iteritems():
-            if not pk in vattrs['supported']:
-                self.die('Unsupported project: {0}'.format(pk))
-                
-            # Make sure required attributes are set
-            for k in vattrs['attributes']['required']:
-                if not k in pa:
-                    self.die('Missing required project attribute <{0}> for <{1}>'.format(k, pk))
-        
-        # Return projects
-        return self.config['PROJECTS']
+        :param project: The project name
+        :type  project: str
+        :param   attrs: Project attributes
+        :type    attrs: dict
+        :param  branch: The branch being built
+        :type   branch: str
+        :rtype: DevToolsTreeIndex|None
+        """
+        if not self.config.get('TREE_INDEX', {}).get('enabled', True):
+            return None
+        root = self.project_root(project, attrs, branch)
+        src  = '{0}/{1}'.format(root, project)
+        return None if not path.isdir(src) else DevToolsTreeIndex(root, src)
         
-    def _get_workspace(self):
+    def git_pool_size(self, count):
         """
-        Retrieve the devtools workspace path.
+        Return the number of concurrent git operations for a number of
+        targets, bounded by <GIT.concurrency>.
         
-        :rtype: str
+        :param count: The number of targets
+        :type  count: int
+        :rtype: int
         """
-        if not 'WORKSPACE' in self.config:
-            self.die('Missing required <WORKSPACE> key in: {0}'.format(self.config))
-        return self.mkdir(path.expanduser('~/{0}'.format(self.config['WORKSPACE'])))
+        limit = int(self.config.get('GIT', {}).get('concurrency', 0))
+        return max(1, min(count, limit) if limit else count)
         
     def validate_projects(self, projects):
         """
@@ -107,36 +123,42 @@ class DevToolsCommon(object):
         self.feedback.error(message)
         exit(code)
         
-    def targz(self, tarball, source, workdir=None):
+    def tarball_engine(self):
         """
-        Make a new Gzip tar file.
+        Return the source tarball engine configured by the <TARBALL> key.
+        
+        :rtype: DevToolsTarball
+        """
+        settings = self.config.get('TARBALL', {})
+        try:
+            return DevToolsTarball(
+                compression = settings.get('compression', 'gz'),
+                threads     = settings.get('threads', 0),
+                level       = settings.get('level', 6)
+            )
+        except Exception as e:
+            self.die(str(e))
+        
+    def mktar(self, tarball, source, basedir):
+        """
+        Make a new compressed tar file.
         
         :param tarball: The destination tarball to create
         :type  tarball: str
         :param  source: The source folder to compress
         :type   source: str
-        :param workdir: Change to a new working directory
-        :type  workdir: str
+        :param basedir: The base directory for relative tarball/source paths
+        :type  basedir: str
         """
+        if not path.isdir(basedir):
+            self.die('Cannot create tarball in <{0}>, directory not found'.format(basedir))
         
-        # Get the current working directory
-        cwd = getcwd()
-        
-        # If changing working directories prior to compressing
-        if workdir:
-            if not path.isdir(workdir):
-                self.die('Cannot change to working directory <{0}>, not found'.format(workdir))
-        
-            # Change working directories
-            chdir(workdir)
-        
-        # Create the tarfile
-        with tarfile.open(tarball, 'w:gz') as tar:
-            tar.add(source)
+        # Stream the source into the compressor
+        try:
+            self.tarball_engine().create(tarball, source, basedir)
+        except Exception as e:
+            self.die('Failed to create tarball <{0}>: {1}'.format(tarball, str(e)))
         self.feedback.info('Created tarball: {0}'.format(tarball))
-            
-        # Revert directory
-        chdir(cwd)
         
     def rmfile(self, file):
         """
@@ -170,6 +192,81 @@ class DevToolsCommon(object):
         """
         symlink(target, link)
         
+    def swaplink(self, target, link):
+        """
+        Atomically point a symbolic link at a new target. The new link is
+        renamed over the old one, so readers see either the old or the new
+        target, never a missing link.
+        
+        :param target: The target file
+        :type  target: str
+        :param   link: The target link
+        :type    link: str
+        """
+        tmp = '{0}.tmp-{1}-{2}'.format(link, getpid(), current_thread().ident)
+        self.rmfile(tmp)
+        symlink(target, tmp)
+        rename(tmp, link)
+        
+    def _reflink(self, src, dst):
+        """
+        Clone a file sharing its data blocks, copying if the filesystem does
+        not support it.
+        
+        :param src: The source file
+        :type  src: str
+        :param dst: The destination file
+        :type  dst: str
+        """
+        with open(src, 'rb') as s, open(dst, 'wb') as d:
+            try:
+                ioctl(d.fileno(), FICLONE, s.fileno())
+                cloned = True
+            except (IOError, OSError):
+                cloned = False
+        if cloned:
+            copystat(src, dst)
+        else:
+            copy2(src, dst)
+        
+    def linkfile(self, src, dst):
+        """
+        Make a file available at another path without copying its data where
+        possible: hardlink, then reflink, then copy. The file is staged next
+        to the destination and renamed into place.
+        
+        :param src: The source file
+        :type  src: str
+        :param dst: The destination file
+        :type  dst: str
+        """
+        tmp = '{0}.tmp-{1}-{2}'.format(dst, getpid(), current_thread().ident)
+        self.rmfile(tmp)
+        try:
+            link(src, tmp)
+        except OSError:
+            self._reflink(src, tmp)
+        rename(tmp, dst)
+        
+    def placefile(self, src, dst):
+        """
+        Move a file into place, renaming when on the same filesystem and
+        linking/copying across filesystems. The destination never appears
+        partially written.
+        
+        :param src: The source file
+        :type  src: str
+        :param dst: The destination file
+        :type  dst: str
+        """
+        try:
+            rename(src, dst)
+        except OSError as e:
+            if not e.errno == EXDEV:
+                raise
+            self.linkfile(src, dst)
+            unlink(src)
+        
     def mkdir(self, dir_path):
         """
         Make a directory and return the path name.
@@ -177,7 +274,13 @@ class DevToolsCommon(object):
         :rtype: str
         """
         if not path.isdir(dir_path):
-            makedirs(dir_path)
+            try:
+                makedirs(dir_path)
+            
+            # Created concurrently by another build
+            except OSError as e:
+                if not e.errno == EEXIST:
+                    raise
         return dir_path
         
     def get_revision(self, project):
@@ -189,25 +292,113 @@ class DevToolsCommon(object):
         :rtype: str
         """
         
-    def shell(self, cmd, stdout=False):
+    def _stream(self, pipe, sinks, lock, buffer):
         """
-        Run an arbitrary shell command.
+        Forward a process pipe line by line.
+        
+        :param   pipe: The pipe to read from
+        :type    pipe: file
+        :param  sinks: File objects to copy each line to
+        :type   sinks: list
+        :param   lock: Lock shared by all streams writing to the sinks
+        :type    lock: Lock
+        :param buffer: Collects the output (a bounded deque keeps only the tail)
+        :type  buffer: list|deque
+        """
+        for line in iter(pipe.readline, ''):
+            with lock:
+                for sink in sinks:
+                    sink.write(line)
+                    sink.flush()
+            buffer.append(line)
+        pipe.close()
+        
+    def _kill(self, proc, killed=None):
+        """
+        Kill a running process and every process in its session, ignoring
+        processes that already exited.
+        
+        :param   proc: The process to kill, started as a session leader
+        :type    proc: Popen
+        :param killed: Set once the processes were killed
+        :type  killed: Event
+        """
+        try:
+            killpg(proc.pid, SIGKILL)
+        except OSError:
+            pass
+        if killed:
+            killed.set()
         
-        :param stdout: Capture stdout or not
-        :type  stdout: bool
-        :rtype: str|None
+    def shell(self, cmd, stdout=False, cwd=None, log=None, echo=False, timeout=None, tail=100):
+        """
+        Run an arbitrary shell command. Output is streamed line by line, only
+        the last lines of stderr are kept in memory.
+        
+        :param  stdout: Capture stdout or not
+        :type   stdout: bool
+        :param     cwd: Run the command in this directory
+        :type      cwd: str
+        :param     log: Append stdout/stderr to this log file
+        :type      log: str
+        :param    echo: Forward stderr (and logged stdout) to the console
+        :type     echo: bool
+        :param timeout: Kill the command after this many seconds
+        :type  timeout: int
+        :param    tail: Number of stderr lines to return
+        :type     tail: int
+        :rtype: tuple
         """
         if not isinstance(cmd, list):
             raise Exception('<DevToolsCommon.shell> command argument must be a list')
         
-        # Start the process
-        proc = Popen(cmd, stdout=PIPE, stderr=PIPE) if stdout else Popen(cmd, stderr=PIPE)
-        
-        # Call the command
+        # Pipe stdout if capturing or logging it, otherwise it goes straight to the console
+        # (timed commands run in their own session so the whole process tree can be killed)
+        logfile = None if not log else open(log, 'a')
+        proc    = Popen(cmd, stdout=PIPE if (stdout or logfile) else None, stderr=PIPE, cwd=cwd, preexec_fn=setsid if timeout else None)
+        lock    = Lock()
+        
+        # Captured stdout / stderr tail
+        out     = []
+        err     = deque(maxlen=tail)
+        
+        # Stream each pipe on its own thread
+        streams = [Thread(target=self._stream, args=(proc.stderr, [s for s in [logfile, console_err if echo else None] if s], lock, err))]
+        if proc.stdout:
+            streams.append(Thread(target=self._stream, args=(proc.stdout, [s for s in [logfile, console_out if not stdout else None] if s], lock, out if stdout else deque(maxlen=0))))
+        for t in streams:
+            t.daemon = True
+            t.start()
+        
+        # Kill the process if it runs too long
+        timer  = None
+        killed = Event()
+        if timeout:
+            timer = Timer(timeout, self._kill, [proc, killed])
+            timer.start()
+        
+        # Wait for the command and its output, processes escaping the kill may hold the pipes open
+        try:
+            for t in streams:
+                while t.is_alive() and not killed.is_set():
+                    t.join(0.5)
+                t.join(KILL_GRACE if killed.is_set() else None)
+            proc.wait()
+        except BaseException:
+            if timeout:
+                self._kill(proc)
+            raise
+        finally:
+            if timer:
+                timer.cancel()
+            if logfile:
+                logfile.close()
+        
+        # Command timed out
+        if killed.is_set() and proc.returncode < 0:
+            err.append('Command timed out after {0} seconds\n'.format(timeout))
+        
+        # Return the exit code and output
         if stdout:
-            out, err = proc.communicate()
-            return proc.returncode, out, err
-        else:
-            err = proc.communicate()
-            return proc.returncode, err
-        
\ No newline at end of file
+            return proc.returncode, ''.join(out), ''.join(err)
+        return proc.returncode, ''.join(err)
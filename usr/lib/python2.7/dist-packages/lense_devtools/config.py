@@ -0,0 +1,169 @@
+from threading import Lock
+from errno import EEXIST
+from json import loads as json_loads
+from os import path, stat, makedirs, environ
+
+# Configuration file / project attributes manifest (overridable from the environment)
+CONFIG_FILE   = environ.get('LENSE_DEVTOOLS_CONFIG', '/etc/lense_devtools/config.json')
+MANIFEST_FILE = environ.get('LENSE_DEVTOOLS_MANIFEST', '/usr/share/lense_devtools/project.json')
+
+class DevToolsConfigError(Exception):
+    """
+    Raised when the configuration cannot be loaded or validated.
+    """
+    pass
+
+class FrozenDict(dict):
+    """
+    Read-only dictionary used for shared configuration values.
+    """
+    def _immutable(self, *args, **kwargs):
+        raise TypeError('<{0}> object is immutable'.format(self.__class__.__name__))
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _immutable
+
+def freeze(obj):
+    """
+    Recursively convert dicts and lists to immutable types.
+
+    :param obj: The object to freeze
+    :type  obj: object
+    :rtype: object
+    """
+    if isinstance(obj, dict):
+        return FrozenDict((k, freeze(v)) for k,v in obj.iteritems())
+    if isinstance(obj, list):
+        return tuple(freeze(v) for v in obj)
+    return obj
+
+class DevToolsConfig(object):
+    """
+    Loaded and validated devtools configuration, shared by all instances in
+    the process and only reloaded when the configuration files change.
+    """
+
+    # Loaded configurations keyed by file paths / cache lock
+    _cache = {}
+    _lock  = Lock()
+
+    def __init__(self, config_file=CONFIG_FILE, manifest_file=MANIFEST_FILE):
+        """
+        :param   config_file: The devtools configuration file
+        :type    config_file: str
+        :param manifest_file: The project attributes manifest
+        :type  manifest_file: str
+        """
+        self.files     = (config_file, manifest_file)
+        self.mtimes    = self._mtimes(config_file, manifest_file)
+
+        # Configuration / workspace / projects / disabled projects
+        self.config    = freeze(self._load(config_file, 'Configuration file missing'))
+        self.workspace = self._get_workspace()
+        self.projects  = self._get_projects(self._load(manifest_file, 'Could not locate project attributes manifest'))
+        self.disabled  = self.config.get('DISABLED', ())
+
+    @staticmethod
+    def _mtimes(*files):
+        """
+        Return the modification times of a list of files.
+
+        :rtype: tuple
+        """
+        mtimes = []
+        for f in files:
+            try:
+                mtimes.append(stat(f).st_mtime)
+            except OSError:
+                mtimes.append(None)
+        return tuple(mtimes)
+
+    def _load(self, file, missing):
+        """
+        Load a JSON file.
+
+        :param    file: The file to load
+        :type     file: str
+        :param missing: Error message prefix if the file does not exist
+        :type  missing: str
+        :rtype: dict
+        """
+        if not path.isfile(file):
+            raise DevToolsConfigError('{0}: <{1}> not found'.format(missing, file))
+
+        try:
+            with open(file, 'r') as f:
+                return json_loads(f.read())
+        except Exception as e:
+            raise DevToolsConfigError('Failed to parse <{0}>: {1}'.format(file, str(e)))
+
+    def _get_projects(self, vattrs):
+        """
+        Validate and return the configured projects.
+
+        :param vattrs: The project attributes manifest
+        :type  vattrs: dict
+        :rtype: FrozenDict
+        """
+        if not 'PROJECTS' in self.config:
+            raise DevToolsConfigError('Missing required <PROJECTS> key in: {0}'.format(self.files[0]))
+
+        # Projects must be a dict
+        if not isinstance(self.config['PROJECTS'], dict):
+            raise DevToolsConfigError('Required key <PROJECTS> must be a dict')
+
+        # Validate projects
+        for pk,pa in self.config['PROJECTS'].iteritems():
+            if not pk in vattrs['supported']:
+                raise DevToolsConfigError('Unsupported project: {0}'.format(pk))
+
+            # Make sure required attributes are set
+            for k in vattrs['attributes']['required']:
+                if not k in pa:
+                    raise DevToolsConfigError('Missing required project attribute <{0}> for <{1}>'.format(k, pk))
+
+            # Dependencies must be supported projects
+            for d in pa.get('depends', ()):
+                if not d in vattrs['supported']:
+                    raise DevToolsConfigError('Unsupported dependency <{0}> for <{1}>'.format(d, pk))
+
+        # Return projects
+        return self.config['PROJECTS']
+
+    def _get_workspace(self):
+        """
+        Retrieve and create the devtools workspace path.
+
+        :rtype: str
+        """
+        if not 'WORKSPACE' in self.config:
+            raise DevToolsConfigError('Missing required <WORKSPACE> key in: {0}'.format(self.files[0]))
+        workspace = path.expanduser('~/{0}'.format(self.config['WORKSPACE']))
+
+        # Create the workspace once per load
+        try:
+            makedirs(workspace)
+        except OSError as e:
+            if not e.errno == EEXIST:
+                raise DevToolsConfigError('Failed to create workspace <{0}>: {1}'.format(workspace, str(e)))
+        return workspace
+
+    @classmethod
+    def get(cls, config_file=CONFIG_FILE, manifest_file=MANIFEST_FILE):
+        """
+        Return the shared configuration, reloading it if either file changed.
+
+        :param   config_file: The devtools configuration file
+        :type    config_file: str
+        :param manifest_file: The project attributes manifest
+        :type  manifest_file: str
+        :rtype: DevToolsConfig
+        """
+        key = (config_file, manifest_file)
+        with cls._lock:
+            cached = cls._cache.get(key)
+            if cached and cached.mtimes == cls._mtimes(*key):
+                return cached
+
+            # Load and validate a fresh copy
+            cls._cache[key] = cls(config_file, manifest_file)
+            return cls._cache[key]
@@ -0,0 +1,255 @@
+import socket
+from os import path, unlink, chmod
+from Queue import Queue
+from itertools import count
+from threading import Thread, Lock, Event
+from SocketServer import ThreadingUnixStreamServer, StreamRequestHandler
+from json import dumps as json_dumps, loads as json_loads
+from feedback import Feedback
+
+# Commands accepted by the daemon
+DAEMON_COMMANDS = ['build', 'install']
+
+def socket_path(config, workspace):
+    """
+    Return the daemon socket path.
+
+    :param    config: The devtools configuration
+    :type     config: dict
+    :param workspace: The workspace path
+    :type  workspace: str
+    :rtype: str
+    """
+    return path.expanduser(config.get('DAEMON', {}).get('socket', '{0}/devtools.sock'.format(workspace)))
+
+class DevToolsJob(object):
+    """
+    A queued build or install job.
+    """
+    def __init__(self, id, command, projects, options, commits):
+        """
+        :param       id: The job ID
+        :type        id: int
+        :param  command: The command to run (build, install)
+        :type   command: str
+        :param projects: The projects to run the command for
+        :type  projects: list
+        :param  options: Command line options (auto, jobs, batch)
+        :type   options: dict
+        :param  commits: Project/remote commit pairs at submission time
+        :type   commits: dict
+        """
+        self.id       = id
+        self.command  = command
+        self.projects = projects
+        self.options  = options
+        self.commits  = commits
+
+        # Job result / finished event / started flag
+        self.result   = None
+        self.done     = Event()
+        self.started  = False
+
+class DevToolsRequestHandler(StreamRequestHandler):
+    """
+    Handle a single client request: one JSON line in, JSON lines out.
+    """
+    def _send(self, data):
+        self.wfile.write('{0}\n'.format(json_dumps(data)))
+        self.wfile.flush()
+
+    def handle(self):
+        try:
+            request = json_loads(self.rfile.readline())
+        except ValueError as e:
+            return self._send({'status': 'error', 'message': 'Invalid request: {0}'.format(str(e))})
+
+        # Queue the job
+        try:
+            jobs, deduped = self.server.daemon.submit(request)
+        except Exception as e:
+            return self._send({'status': 'error', 'message': str(e)})
+        for job in jobs:
+            self._send({'id': job.id, 'status': 'deduplicated' if job in deduped else 'queued', 'projects': job.projects})
+
+        # Wait for the jobs to finish
+        if request.get('wait', True):
+            for job in jobs:
+                job.done.wait()
+                self._send({'id': job.id, 'status': 'done', 'result': job.result})
+
+class DevToolsDaemon(object):
+    """
+    Long running devtools process keeping configuration, repository handles
+    and the apt cache warm, running jobs submitted over a Unix socket.
+    """
+    def __init__(self, interface):
+        """
+        :param interface: The devtools interface used to run jobs
+        :type  interface: DevToolsInterface
+        """
+        self.interface = interface
+        self.feedback  = interface.feedback
+        self.socket    = socket_path(interface.config, interface.workspace)
+
+        # Job queue / pending jobs / job IDs / queue lock
+        self._queue    = Queue()
+        self._pending  = []
+        self._ids      = count(1)
+        self._lock     = Lock()
+
+    def _remote_commits(self, projects):
+        """
+        Resolve the remote head of each project for job deduplication.
+
+        :rtype: dict
+        """
+        commits = {}
+        for p in projects:
+            commits[p] = self.interface.gitrepo(p).ls_remote()
+        return commits
+
+    def submit(self, request):
+        """
+        Queue a job, reusing queued jobs for the same project and commit.
+
+        :param request: The client request
+        :type  request: dict
+        :rtype: tuple
+        """
+        command = request.get('command')
+        if not command in DAEMON_COMMANDS:
+            raise Exception('Unsupported daemon command: {0}'.format(command))
+        projects = request.get('projects') or sorted(self.interface.projects.keys())
+        for p in projects:
+            if not p in self.interface.projects:
+                raise Exception('Project <{0}> not in supported list: {1}'.format(p, ', '.join(self.interface.projects.keys())))
+        options  = {'auto': True, 'jobs': request.get('jobs', 1), 'batch': request.get('batch', False)}
+        commits  = {} if not command == 'build' else self._remote_commits(projects)
+
+        with self._lock:
+            deduped = []
+            for job in self._pending:
+                if job.started or not job.command == command:
+                    continue
+
+                # Drop projects already queued at the same commit
+                matched = [p for p in projects if p in job.projects and (command == 'install' or job.commits.get(p) == commits.get(p))]
+                if matched:
+                    deduped.append(job)
+                    projects = [p for p in projects if not p in matched]
+
+            # Everything is already queued
+            if not projects:
+                return deduped, deduped
+
+            # Queue the remaining projects
+            job = DevToolsJob(next(self._ids), command, projects, options, dict((p, commits.get(p)) for p in projects))
+            self._pending.append(job)
+        self._queue.put(job)
+        self.feedback.info('Queued job {0}: {1} {2}'.format(job.id, command, ', '.join(projects)))
+        return deduped + [job], deduped
+
+    def _worker(self):
+        """
+        Run queued jobs one at a time.
+        """
+        while True:
+            job = self._queue.get()
+            with self._lock:
+                job.started = True
+            try:
+                job.result = self.interface.run_job(job.command, job.projects, job.options)
+            except (SystemExit, Exception) as e:
+                self.feedback.error('Job {0} failed: {1}'.format(job.id, str(e)))
+                job.result = False
+            finally:
+                with self._lock:
+                    self._pending.remove(job)
+                job.done.set()
+
+    def _bind(self):
+        """
+        Bind the Unix socket, removing a stale socket left by a dead daemon.
+
+        :rtype: ThreadingUnixStreamServer
+        """
+        if path.exists(self.socket):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket)
+                probe.close()
+                raise Exception('Daemon already running on: {0}'.format(self.socket))
+            except socket.error:
+                unlink(self.socket)
+
+        # Only the workspace owner may submit jobs
+        server = ThreadingUnixStreamServer(self.socket, DevToolsRequestHandler)
+        chmod(self.socket, 0o600)
+        server.daemon_threads = True
+        server.daemon = self
+        return server
+
+    def serve(self):
+        """
+        Serve jobs until interrupted.
+        """
+        server = self._bind()
+        worker = Thread(target=self._worker)
+        worker.daemon = True
+        worker.start()
+        self.feedback.success('Devtools daemon listening on: {0}'.format(self.socket))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            self.feedback.info('Stopping devtools daemon')
+        finally:
+            server.server_close()
+            if path.exists(self.socket):
+                unlink(self.socket)
+
+class DevToolsClient(object):
+    """
+    Thin client submitting jobs to a running devtools daemon.
+    """
+    def __init__(self, socket_file):
+        """
+        :param socket_file: The daemon socket path
+        :type  socket_file: str
+        """
+        self.socket   = socket_file
+        self.feedback = Feedback()
+
+    def submit(self, request):
+        """
+        Submit a job and report its progress.
+
+        :param request: The job request
+        :type  request: dict
+        :rtype: bool
+        """
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            conn.connect(self.socket)
+        except socket.error as e:
+            self.feedback.error('Could not connect to daemon <{0}>: {1}'.format(self.socket, str(e)))
+            return False
+
+        # Send the request and read responses until the daemon closes
+        ok = True
+        try:
+            conn.sendall('{0}\n'.format(json_dumps(request)))
+            for line in conn.makefile('r'):
+                response = json_loads(line)
+                if response['status'] == 'error':
+                    self.feedback.error(response['message'])
+                    ok = False
+                elif response['status'] == 'done':
+                    result = response['result']
+                    ok     = ok and not (result is False or (isinstance(result, dict) and not all(result.values())))
+                    self.feedback.info('Job {0} finished: {1}'.format(response['id'], response['result']))
+                else:
+                    self.feedback.info('Job {0} {1}: {2}'.format(response['id'], response['status'], ', '.join(response['projects'])))
+        finally:
+            conn.close()
+        return ok
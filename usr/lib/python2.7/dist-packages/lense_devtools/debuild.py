@@ -1,15 +1,23 @@
-from re import compile
 from socket import getfqdn
 from getpass import getuser
 from datetime import datetime
-from os import chdir, path, unlink, symlink, environ
+from os import path, unlink, symlink, environ
 from lense_devtools.common import DevToolsCommon
+from lense_devtools.timing import timed, DevToolsTimer
+from lense_devtools.patches import DevToolsQuiltPatches
+from lense_devtools.changelog import DevToolsChangelog
+from lense_devtools.revisions import DevToolsRevisions
+from lense_devtools.artifacts import DevToolsArtifactCache
+from lense_devtools.publish import DevToolsPublisher
+from lense_devtools.aptrepo import DevToolsAptRepo
+from lense_devtools.checkpoint import DevToolsCheckpoint
+from lense_devtools.buildroot import DevToolsBuildRoot
 
 class DevToolsDebuild(DevToolsCommon):
     """
     Helper class for building a debian package from a project.
     """
-    def __init__(self, project, attrs, build=False, automode=False):
+    def __init__(self, project, attrs, build=False, automode=False, commit=None, since=None, branch=None, local=False, force=False):
         """
         :param project: The project name
         :type  project: str
@@ -17,6 +25,16 @@ class DevToolsDebuild(DevToolsCommon):
         :type    attrs: dict
         :param   build: Should we build or not
         :type    build: bool
+        :param  commit: The commit SHA of the source tree
+        :type   commit: str
+        :param   since: The commit SHA the source tree was updated from
+        :type    since: str
+        :param  branch: Build this branch instead of <git-branch>
+        :type   branch: str
+        :param   local: The working tree has local changes not in <commit>
+        :type    local: bool
+        :param   force: Rebuild for a changed dependency, bypassing the artifact cache
+        :type    force: bool
         """
         super(DevToolsDebuild, self).__init__()
         
@@ -24,27 +42,65 @@ class DevToolsDebuild(DevToolsCommon):
         self.build     = build
         self.automode  = automode
 
-        # Name / root / source / version
+        # Name / branch / target label / root / source / version
         self.name      = project
-        self.root      = '{0}/{1}'.format(self.workspace, attrs.get('git-local'))
+        self.branch    = branch or attrs.get('git-branch')
+        self.label     = project if self.branch == attrs.get('git-branch') else '{0}@{1}'.format(project, self.branch)
+        self.root      = self.project_root(project, attrs, self.branch)
         self.src       = '{0}/{1}'.format(self.root, project)
         self.version   = attrs.get('version')
+        
+        # Build output directory for this branch
+        self.broot     = self.build_root(attrs, self.branch)
+        
+        # Build log / build timeout / echo build output to the console
+        settings       = self.config.get('BUILD', {})
+        self.log       = '{0}/{1}.log'.format(self.mkdir('{0}/logs'.format(self.workspace)), self.label.replace('/', '_'))
+        self.timeout   = int(settings.get('timeout', 0)) or None
+        self.echo      = settings.get('echo', True)
+        
+        # Target distribution / build backend (host, overlay)
+        self.dist      = settings.get('distribution', 'trusty')
+        self.backend   = settings.get('backend', 'host')
+        
+        # Patch generation mode / patch stack size that triggers a re-base / source commits
+        patches        = self.config.get('PATCHES', {})
+        self.pmode     = patches.get('mode', 'dpkg-source')
+        self.rebase    = int(patches.get('rebase-bytes', 0))
+        self.commit    = commit
+        self.since     = since
+        
+        # Source tree index / local changes make the commit an unreliable cache key
+        self.index     = self.tree_index(project, attrs, self.branch)
+        self.local     = local
+        
+        # Forced rebuild, a cached package of the same commit is what is being replaced
+        self.force     = force
+        
+        # Package publisher / APT repository / current package link / build artifact cache
+        self.publisher = DevToolsPublisher(self.broot)
+        self.aptrepo   = DevToolsAptRepo(self.broot)
+        self.current   = self.publisher.current(self.name)
+        self.artifacts = DevToolsArtifactCache(project, attrs, commit, branch=self.branch)
+        
+        # Pipeline checkpoint of an unfinished build
+        self.checkpoint = DevToolsCheckpoint(self.root)
 
     def _preflight(self):
         """
         Run preflight checks prior to building.
         """
-        if not self.build:
+        if not self.build and not self.checkpoint.pending():
             self.feedback.info('Source code has not changed, skipping build')
             return False
 
-        # Revisions history / revision / changelog
-        self.revisions = '{0}/revisions.txt'.format(self.root)
-        self.revision  = self._set_revision()
+        # Revisions history / revision (the unfinished build's if resuming) / changelog
+        self.revisions = DevToolsRevisions(self.root)
+        self.revision  = self._resume_revision() or self._set_revision()
         self.chlog     = '{0}/debian/changelog'.format(self.src)
 
         # Define the source tarball
-        self.tarball   = '{0}_{1}.orig.tar.gz'.format(self.name, self.version)
+        self.tarball   = '{0}_{1}.orig.{2}'.format(self.name, self.version, self.tarball_engine().extension)
         self.tarpath   = '{0}/{1}'.format(self.root, self.tarball)
 
         # Define the output debian package
@@ -52,8 +108,7 @@ class DevToolsDebuild(DevToolsCommon):
         self.debpath   = '{0}/{1}'.format(self.root, self.debpkg)
 
         # Build output directory / current package
-        self.bdir      = self.mkdir('{0}/build/{1}-{2}'.format(self.workspace, self.version, self.revision))
-        self.current   = '{0}/build/current/{1}_current_all.deb'.format(self.workspace, self.name)
+        self.bdir      = self.mkdir('{0}/{1}-{2}'.format(self.broot, self.version, self.revision))
 
         # Preflight OK
         return True
@@ -67,27 +122,103 @@ class DevToolsDebuild(DevToolsCommon):
         offset = '+0000'
         return datetime.now().strftime('%a, %d %b %Y %H:%M:%S {0}'.format(offset))
 
+    def _base_commit(self):
+        """
+        Get the commit of the last successfully built revision, falling back
+        to the commit the repository was updated from.
+        
+        :rtype: str|None
+        """
+        for r in self.revisions.history():
+            if r['revision'] == self.revision or not r['artifact']:
+                continue
+            if r['commit_sha']:
+                return r['commit_sha']
+            break
+        return self.since
+
+    def _git_patch(self, patches, patch_name):
+        """
+        Generate a patch from the git commit range since the last build.
+        
+        :param    patches: The quilt patches handler
+        :type     patches: DevToolsQuiltPatches
+        :param patch_name: The patch name
+        :type  patch_name: str
+        :rtype: bool
+        """
+        base = self._base_commit()
+        if not base or not self.commit:
+            return False
+        
+        # Upstream changes only, the debian directory is packaged separately
+        code, out, err = self.shell(['git', 'diff', '--no-color', '--no-renames', base, self.commit, '--', '.', ':(exclude)debian'], stdout=True, cwd=self.src)
+        if not code == 0:
+            self.feedback.info('Could not diff {0}..{1}, falling back to dpkg-source: {2}'.format(base[:8], self.commit[:8], err.strip()))
+            return False
+        
+        # Quilt cannot represent binary changes
+        if '\nBinary files ' in out or out.startswith('Binary files '):
+            self.feedback.info('Binary changes in {0}..{1}, falling back to dpkg-source'.format(base[:8], self.commit[:8]))
+            return False
+        
+        # Nothing changed outside of the debian directory
+        if not out.strip():
+            self.feedback.info('No upstream changes in {0}..{1}, no patch needed'.format(base[:8], self.commit[:8]))
+            return True
+        patches.add(patch_name, out)
+        self.feedback.success('Generated patch file from {0}..{1} -> {2}'.format(base[:8], self.commit[:8], patch_name))
+        return True
+
+    def _rebase(self, patches):
+        """
+        Drop the generated patch stack and regenerate the original source
+        tarball from the current tree.
+        
+        :param patches: The quilt patches handler
+        :type  patches: DevToolsQuiltPatches
+        """
+        size    = patches.stack_size()
+        removed = patches.clear()
+        self.mktar(self.tarball, self.name, self.root)
+        self.feedback.success('Re-based {0} onto a new source tarball, removed {1} patches ({2} bytes)'.format(self.name, removed, size))
+
+    @timed('patch')
     def _dpkg_patch(self):
         """
-        Run a dpkg-source --commit to generate patches for non-base revisions.
+        Generate patches for non-base revisions.
         """
         if not self.revision == 'dev0':
             patch_name = 'patch_{0}'.format(self.revision)
+            patches    = DevToolsQuiltPatches(self.src)
+            
+            # Left behind by an unfinished build of this revision
+            if patches.remove(patch_name):
+                self.feedback.info('Removed unfinished patch file -> {0}'.format(patch_name))
+            
+            # Patch stack is too large, re-base onto a new tarball instead
+            if self.rebase and patches.stack_size() >= self.rebase:
+                return self._rebase(patches)
+            
+            # Patch from the git commit range (misses uncommitted local changes)
+            if self.pmode == 'git' and not self.local and self._git_patch(patches, patch_name):
+                return None
             environ['EDITOR'] = '/bin/true'
             
             # Run dpkg-source
-            code, err = self.shell(['dpkg-source', '-q', '--commit', '.', patch_name])
+            code, err = self.shell(['dpkg-source', '-q', '--commit', '.', patch_name], cwd=self.src, log=self.log)
     
             # Make sure the patch was created
             if not code == 0:
                 self.die('Failed to generate "{0}": {1}'.format(patch_name, str(err)))
             self.feedback.success('Generated patch file -> {0}'.format(patch_name))
 
+    @timed('changelog')
     def _set_changelog(self):
         """
         Set the next changelog entry prior to building.
         """
-        release   = '{0} ({1}-{2}) trusty; urgency=low'.format(self.name, self.version, self.revision)
+        release   = '{0} ({1}-{2}) {3}; urgency=low'.format(self.name, self.version, self.revision, self.dist)
         
         # Get a user message if not automated
         user_msg = ''
@@ -102,65 +233,62 @@ class DevToolsDebuild(DevToolsCommon):
         # Set the author line
         author    = ' -- Developer <{0}@{1}>  {2}'.format(getuser(), getfqdn(), self.timestamp())
     
-        # Create the file if it doesnt exist
-        if not path.isfile(self.chlog):
-            chlog_orig = ''
-        else:
-            # Get the current changelog
-            with open(self.chlog, 'r') as f:
-                chlog_orig = f.read()
-                f.close()
-        
-        # Write to the changelog
-        entry = '{0}\n\n{1}\n\n{2}'.format(release, comment, author)
-        with open(self.chlog, 'w') as f:
-            f.write('{0}\n\n'.format(entry))
-            f.write(chlog_orig)
+        # Prepend the entry, dropping old development entries past the limit
+        entry   = '{0}\n\n{1}\n\n{2}'.format(release, comment, author)
+        dropped = DevToolsChangelog(self.chlog, self.config.get('CHANGELOG', {}).get('max-dev-entries', 0)).prepend(entry)
+        if dropped:
+            self.feedback.info('Dropped {0} old development entries from "{1}"'.format(dropped, self.chlog))
         self.feedback.info('Appended to "{0}":\n{1}\n{2}\n{3}'.format(self.chlog, '-' * 60, entry, '-' * 60))
 
     def _set_revision(self):
         """
-        Get the next revision number
+        Allocate the next revision in the revision store.
         """
-        revision = None
-        if not path.isfile(self.revisions):
+        revision = self.revisions.allocate(commit=self.artifacts.commit, timestamp=self.timestamp())
+        if revision == 'dev0':
             self.feedback.info('Building base revision -> dev0')
-            with open(self.revisions, 'w') as f:
-                f.write('dev0:: {0}\n'.format(self.timestamp()))
-            return 'dev0'
-        
-        # Read the latest revision
-        with open(self.revisions, 'r') as f:
-            revision = f.readline().rstrip()
-                
-        # Extract ID and number
-        rev_ex = compile(r'(^[a-zA-Z]*)([0-9]*)::.*$')
-        rev_id = rev_ex.sub(r'\g<1>', revision)
-        rev_num = rev_ex.sub(r'\g<2>', revision)
-                
-        # Next revision
-        rev_nxt = '{0}{1}'.format(rev_id, int(rev_num) + 1)
-        self.feedback.info('Building next revision -> {0}'.format(rev_nxt))
-        
-        # Read the entire revisions file
-        all_revisions = None
-        with open(self.revisions, 'r') as f:
-            all_revisions = f.read()
-        
-        # Store the next revision
-        with open(self.revisions, 'w') as f:
-            f.write('{0}:: {1}\n'.format(rev_nxt, self.timestamp()))
-            f.write(all_revisions)
-        
-        # Return the next revision string
-        return rev_nxt
+        else:
+            self.feedback.info('Building next revision -> {0}'.format(revision))
+        self.checkpoint.start(revision, self.commit)
+        return revision
+
+    def _resume_revision(self):
+        """
+        Return the revision of an unfinished build to resume.
+        
+        :rtype: str|None
+        """
+        if not self.checkpoint.pending():
+            return None
+        stages = self.checkpoint.resume(self.commit)
+        self.revisions.set_commit(self.checkpoint.revision, self.commit)
+        self.feedback.info('Resuming revision {0}{1}'.format(
+            self.checkpoint.revision, '' if not stages else ', completed: {0}'.format(', '.join(stages))
+        ))
+        return self.checkpoint.revision
+
+    def _stage(self, stage, method):
+        """
+        Run a pipeline stage unless an earlier run already completed it.
+        
+        :param  stage: The stage name
+        :type   stage: str
+        :param method: The stage method
+        :type  method: callable
+        """
+        if self.checkpoint.done(stage):
+            self.feedback.info('Stage <{0}> already completed for {1}, skipping'.format(stage, self.revision))
+            return None
+        method()
+        self.checkpoint.complete(stage)
 
+    @timed('tarball')
     def _tar_source(self):
         """
         Compress the source directory for the base revision.
         """
         if self.revision == 'dev0':
-            return self.targz(self.tarball, self.name, workdir=self.root)
+            return self.mktar(self.tarball, self.name, self.root)
         
         # Next revision, tar file should be present
         if not path.isfile(self.tarpath):
@@ -172,49 +300,100 @@ class DevToolsDebuild(DevToolsCommon):
         Build the debian package from source
         """
         
-        # Change to the source directory
-        chdir(self.src)
-        
-        # Generate a patch file if needed
-        self._dpkg_patch()
-        
-        # Start building the package
-        code, err = self.shell(['debuild', '-uc', '-us'])
+        # Start building the package in the source directory
+        self.feedback.info('Building {0}, logging to: {1}'.format(self.name, self.log))
+        with DevToolsTimer.phase(self.label, 'debuild'):
+            if self.backend == 'overlay':
+                code, err = self._debuild_isolated()
+            else:
+                code, err = self.shell(['debuild', '-uc', '-us'], cwd=self.src, log=self.log, echo=self.echo, timeout=self.timeout)
 
         # Make sure the build was successfull
         if not code == 0:
-            self.feedback.error('Failed to build {0}: {1}'.format(self.name, str(err)))
+            self.die('Failed to build {0} (see {1}): {2}'.format(self.name, self.log, str(err)))
+
+    def _debuild_isolated(self):
+        """
+        Build the package in a throwaway overlay instance of the distribution
+        base root filesystem, installing the build dependencies there.
         
-        # Change to the project root directory
-        chdir(self.root)
+        :rtype: tuple
+        """
+        buildroot = DevToolsBuildRoot(self.dist)
+        try:
+            with buildroot.instance(self.label, self.root) as merged:
+                self.feedback.info('Building {0} in isolated {1} instance: {2}'.format(self.name, self.dist, merged))
+                return self.shell(buildroot.command(merged, self.name,
+                    "mk-build-deps -i -r -t 'apt-get -y --no-install-recommends' debian/control && debuild -uc -us"
+                ), log=self.log, echo=self.echo, timeout=self.timeout)
+        except Exception as e:
+            self.die('Failed to set up isolated build for {0}: {1}'.format(self.name, str(e)))
+
+    def _publish(self):
+        """
+        Publish the built package
+        """
+        if not path.isfile(self.debpath):
+            self.die('Could not locate built package: {0}'.format(self.debpath))
 
-        # Move to the builds directory
-        latest = '{0}/{1}'.format(self.bdir, self.debpkg)
-        self.mvfile(self.debpkg, latest)
+        # Move to the builds directory and swap the current link to it
+        latest = self.publisher.publish(self.name, self.debpath, self.bdir)
         self.feedback.success('Finished building {0}: {1}'.format(self.name, latest))
+        self.feedback.info('Current build package: {0}'.format(self.current))
+        
+        # Append the package to the local APT repository
+        self.aptrepo.add(latest)
+        
+        # Record the package for this revision
+        self.revisions.set_artifact(self.revision, latest)
+        
+        # Cache the package for identical future builds
+        if not self.local:
+            self.artifacts.store(latest)
 
-        # Make sure the current directory exists
-        self.mkdir('{0}/build/current'.format(self.workspace))
+    def _link_cached(self):
+        """
+        Link the current package to a cached build of the same inputs.
+        
+        :rtype: bool
+        """
+        cached = self.artifacts.lookup()
+        if not cached:
+            return False
+        
+        # Point the current package at the cached build
+        self.publisher.link(self.name, cached)
+        self.aptrepo.add(cached)
+        self.feedback.success('Found cached build for {0}@{1}: {2}'.format(self.name, self.artifacts.commit, cached))
+        return True
 
-        # Clear out the old symbolic link
-        self.rmfile(self.current)
-            
-        # Link to the latest DEB
-        self.mklink(latest, self.current)
-        self.feedback.info('Current build package: {0}'.format(self.current))
+    def _mark_built(self):
+        """
+        Record the source tree as built for local change detection.
+        """
+        if self.index:
+            self.index.mark_built(self.commit)
 
     def run(self):
         """
         Public method for starting the build process
         """
 
+        # Reuse a cached package built from the same inputs (unless resuming)
+        if self.build and not self.local and not self.force and not self.checkpoint.pending() and self._link_cached():
+            return self._mark_built()
+
         # Preflight checks
         if not self._preflight():
             return None
 
-        # Update the changelog
-        self._set_changelog()
-
-        # Create the source tarball and build the debian package
-        self._tar_source()
-        self._debuild()
\ No newline at end of file
+        # Update the changelog, create the source tarball / patch, build and publish the package
+        self._stage('changelog', self._set_changelog)
+        self._stage('tarball', self._tar_source)
+        self._stage('patch', self._dpkg_patch)
+        self._stage('debuild', self._debuild)
+        self._stage('publish', self._publish)
+        
+        # Build finished
+        self.checkpoint.clear()
+        self._mark_built()
\ No newline at end of file
@@ -0,0 +1,196 @@
+from hashlib import sha1
+from os import path, rename
+from json import dumps as json_dumps, loads as json_loads
+from lense_devtools.common import DevToolsCommon
+
+# Relationship fields of the source stanza / binary stanzas
+SOURCE_FIELDS = ['build-depends', 'build-depends-indep', 'build-depends-arch']
+BINARY_FIELDS = ['depends', 'pre-depends']
+
+def parse_control(contents):
+    """
+    Parse a debian/control file into its binary packages and the package
+    names they and the source depend on.
+
+    :param contents: The control file contents
+    :type  contents: str
+    :rtype: tuple
+    """
+    stanzas, fields, last = [], {}, None
+    for line in contents.splitlines():
+        if not line.strip():
+            if fields:
+                stanzas.append(fields)
+            fields, last = {}, None
+        elif line.startswith('#'):
+            continue
+        elif line[0] in ' \t' and last:
+            fields[last] += ' ' + line.strip()
+        elif ':' in line:
+            last, value = line.split(':', 1)
+            last = last.strip().lower()
+            fields[last] = value.strip()
+    if fields:
+        stanzas.append(fields)
+
+    # First stanza is the source package, the rest are binary packages
+    packages, depends = [], set()
+    for i, stanza in enumerate(stanzas):
+        if i > 0 and 'package' in stanza:
+            packages.append(stanza['package'])
+        for field in (SOURCE_FIELDS if i == 0 else BINARY_FIELDS):
+            for relation in stanza.get(field, '').split(','):
+                for alternative in relation.split('|'):
+                    name = alternative.strip().split(' ')[0].split('(')[0].split('[')[0].split(':')[0]
+                    if name and not name.startswith('$'):
+                        depends.add(name)
+    return packages, sorted(depends)
+
+class DevToolsDepGraph(DevToolsCommon):
+    """
+    Project dependency graph derived from each project's debian/control,
+    cached by control file hash. Declared <depends> are always included.
+    """
+    def __init__(self):
+        super(DevToolsDepGraph, self).__init__()
+
+        # Parsed control files cache
+        self.cache  = '{0}/cache/depgraph.json'.format(self.workspace)
+
+        # Project dependencies
+        self.graph  = self._build()
+
+    def _load(self):
+        """
+        Load the parsed control files cache.
+
+        :rtype: dict
+        """
+        try:
+            with open(self.cache, 'r') as f:
+                return json_loads(f.read())
+        except (IOError, ValueError):
+            return {}
+
+    def _save(self, cache):
+        """
+        Replace the parsed control files cache in one step.
+
+        :param cache: The parsed control files
+        :type  cache: dict
+        """
+        self.mkdir(path.dirname(self.cache))
+        tmp = '{0}.tmp'.format(self.cache)
+        with open(tmp, 'w') as f:
+            f.write(json_dumps(cache, sort_keys=True))
+        rename(tmp, self.cache)
+
+    def _control(self, project, cache):
+        """
+        Return the parsed control file of a project, reparsing only when its
+        hash changed.
+
+        :param project: The project name
+        :type  project: str
+        :param   cache: The parsed control files cache
+        :type    cache: dict
+        :rtype: dict|None
+        """
+        control = '{0}/{1}/debian/control'.format(self.project_root(project, self.projects[project]), project)
+        if not path.isfile(control):
+            return None
+        with open(control, 'r') as f:
+            contents = f.read()
+        digest = sha1(contents).hexdigest()
+        if not cache.get(project, {}).get('hash') == digest:
+            packages, depends = parse_control(contents)
+            cache[project] = {'hash': digest, 'packages': packages, 'depends': depends}
+        return cache[project]
+
+    def _build(self):
+        """
+        Build the project dependency graph.
+
+        :rtype: dict
+        """
+        cache    = self._load()
+        previous = json_dumps(cache, sort_keys=True)
+        parsed   = dict((p, self._control(p, cache)) for p in self.projects)
+        if not json_dumps(cache, sort_keys=True) == previous:
+            self._save(cache)
+
+        # Binary packages provided by each project (projects without a control file provide their own name)
+        provides = {}
+        for p, control in parsed.iteritems():
+            for pkg in (control['packages'] if control else [p]):
+                provides[pkg] = p
+
+        # Dependencies between configured projects
+        graph = {}
+        for p in self.projects:
+            depends = set(d for d in self.projects[p].get('depends', []) if d in self.projects)
+            if parsed[p]:
+                depends.update(provides[d] for d in parsed[p]['depends'] if d in provides)
+            depends.discard(p)
+            graph[p] = sorted(depends)
+        return graph
+
+    def depends(self, project):
+        """
+        Return the projects a project depends on.
+
+        :param project: The project name
+        :type  project: str
+        :rtype: list
+        """
+        return self.graph.get(project, [])
+
+    def rdepends(self, projects):
+        """
+        Return every project depending, directly or not, on any of the given
+        projects.
+
+        :param projects: The project names
+        :type  projects: list
+        :rtype: set
+        """
+        found   = set()
+        pending = list(projects)
+        while pending:
+            project = pending.pop()
+            for p, depends in self.graph.iteritems():
+                if project in depends and not p in found and not p in projects:
+                    found.add(p)
+                    pending.append(p)
+        return found
+
+    def waves(self, projects):
+        """
+        Split projects into levels that can each be built in parallel once
+        the previous levels are done. Projects in a dependency cycle end up
+        in a final level of their own.
+
+        :param projects: The project names
+        :type  projects: list
+        :rtype: list
+        """
+        remaining = set(projects)
+        waves     = []
+        while remaining:
+            wave = sorted(p for p in remaining if not [d for d in self.depends(p) if d in remaining])
+            if not wave:
+                self.feedback.error('Dependency cycle between: {0}'.format(', '.join(sorted(remaining))))
+                wave = sorted(remaining)
+            waves.append(wave)
+            remaining.difference_update(wave)
+        return waves
+
+    def order(self, projects):
+        """
+        Return projects in dependency order.
+
+        :param projects: The project names
+        :type  projects: list
+        :rtype: list
+        """
+        return [p for wave in self.waves(projects) for p in wave]
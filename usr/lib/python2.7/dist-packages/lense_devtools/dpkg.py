@@ -1,5 +1,6 @@
 from os.path import basename
 from feedback import Feedback
+from subprocess import Popen, PIPE
 from apt.cache import Cache
 from apt.debfile import DebPackage
 
@@ -9,18 +10,36 @@ class DevToolsDpkg(DebPackage):
     """
     def __init__(self):
         
-        # Get the apt cache
-        self.cache = Cache()
+        # Apt cache (opened on first use) / cache needs a reload
+        self._cache = None
+        self._stale = False
         
         # Feedback module
         self.feedback = Feedback()
         
-    def installdeb(self, pkg):
+    @property
+    def cache(self):
         """
-        Install the Debian package.
+        Open the apt cache on first access and reuse it afterwards.
         
-        :param pkg: The path to the package to install
+        :rtype: Cache
+        """
+        if self._cache is None:
+            self._cache = Cache()
+            
+        # Reload after packages were installed
+        elif self._stale:
+            self._cache.open(None)
+            self._stale = False
+        return self._cache
+        
+    def _check(self, pkg):
+        """
+        Check if a Debian package can and should be installed.
+        
+        :param pkg: The path to the package to check
         :type  pkg: str
+        :rtype: tuple
         """
         
         # Get the DebPackage object and the filename
@@ -31,7 +50,7 @@ class DevToolsDpkg(DebPackage):
         if not dpkg.check_conflicts():
             self.feedback.block(dpkg.conflicts, 'CONFLICT')
             self.feedback.error('Cannot install package <{0}>, conflicts with:'.format(pkg_name))
-            return False
+            return False, None
         
         # Get any version in cache
         cache_version = dpkg.compare_to_version_in_cache()
@@ -43,17 +62,68 @@ class DevToolsDpkg(DebPackage):
             
         # Upgrading
         if cache_version == dpkg.VERSION_OUTDATED:
-            return self.feedback.info('Package <{0}> has newer version installed'.format(pkg_name))
+            self.feedback.info('Package <{0}> has newer version installed'.format(pkg_name))
+            return dpkg, None
             
         # Same version
         if cache_version == dpkg.VERSION_SAME:
-            return self.feedback.info('Package <{0}> already installed'.format(pkg_name))
+            self.feedback.info('Package <{0}> already installed'.format(pkg_name))
+            return dpkg, None
         
         # Installed is newer
         if cache_version == dpkg.VERSION_NEWER:
             self.feedback.info('Package <{0}> outdated, upgrading'.format(pkg_name))
             action = 'Updated'
+        return dpkg, action
+        
+    def installdeb(self, pkg):
+        """
+        Install the Debian package.
+        
+        :param pkg: The path to the package to install
+        :type  pkg: str
+        """
+        dpkg, action = self._check(pkg)
+        if not dpkg:
+            return False
+        if not action:
+            return None
             
         # Install the package
         dpkg.install()
-        self.feedback.success('{0}: {1}'.format(action, pkg_name))
\ No newline at end of file
+        self._stale = True
+        self.feedback.success('{0}: {1}'.format(action, basename(pkg)))
+        
+    def installdebs(self, pkgs):
+        """
+        Install a list of Debian packages in a single dpkg transaction.
+        
+        :param pkgs: Paths to the packages to install, in dependency order
+        :type  pkgs: list
+        :rtype: bool
+        """
+        install = []
+        for pkg in pkgs:
+            dpkg, action = self._check(pkg)
+            
+            # Any conflict aborts the whole transaction
+            if not dpkg:
+                return False
+            if action:
+                install.append((pkg, action))
+        
+        # Nothing to install
+        if not install:
+            self.feedback.info('All packages up to date')
+            return True
+        
+        # Unpack and configure all packages in one dpkg run
+        proc = Popen(['dpkg', '-i'] + [pkg for pkg, action in install], stderr=PIPE)
+        err  = proc.communicate()[1]
+        self._stale = True
+        if not proc.returncode == 0:
+            self.feedback.error('Failed to install packages: {0}'.format(str(err)))
+            return False
+        for pkg, action in install:
+            self.feedback.success('{0}: {1}'.format(action, basename(pkg)))
+        return True
@@ -1,30 +1,73 @@
-from os import path, listdir
+from os import path, listdir, environ
+from threading import Lock, RLock
 from git import Repo, Git
+from lense_devtools.timing import timed
 from lense_devtools.common import DevToolsCommon
 
+def git_environment(config, workspace):
+    """
+    Set up the environment shared by every git process, once per process:
+    SSH remotes reuse one multiplexed connection per host and, if enabled,
+    HTTPS credentials are cached in memory. HTTPS connections themselves are
+    not shared between git processes, each operation makes its own.
+
+    :param    config: The devtools configuration
+    :type     config: dict
+    :param workspace: The workspace path
+    :type  workspace: str
+    """
+    settings = config.get('GIT', {})
+    persist  = int(settings.get('ssh-control-persist', 60))
+    cache    = int(settings.get('credential-cache', 0))
+    if persist:
+        environ.setdefault('GIT_SSH_COMMAND', 'ssh -o ControlMaster=auto -o ControlPath={0}/.ssh-%r@%h:%p -o ControlPersist={1}'.format(workspace, persist))
+
+    # Extra configuration for every git command, after any the user already set (read by git itself)
+    if cache:
+        params = environ.get('GIT_CONFIG_PARAMETERS', '')
+        helper = "'credential.helper=cache --timeout={0}'".format(cache)
+        if not helper in params:
+            environ['GIT_CONFIG_PARAMETERS'] = ' '.join([p for p in [params, helper] if p])
+
 class DevToolsGitRepo(DevToolsCommon):
     """
     Helper class for retrieving a lense project repository.
     """
-    def __init__(self, project, attrs, automode=False):
+    
+    # Per project locks guarding the shared primary clone
+    _locks      = {}
+    _locks_lock = Lock()
+    
+    def __init__(self, project, attrs, automode=False, branch=None):
         """
         :param project: The project name
         :type  project: str
         :param   attrs: Project attributes
         :type    attrs: dict
+        :param  branch: Build this branch instead of <git-branch>
+        :type   branch: str
         """
         super(DevToolsGitRepo, self).__init__()
         
         # Auto mode (avoid prompts)
         self.automode = automode
         
-        # Project name
+        # Project name / attributes
         self.name     = project
+        self.attrs    = attrs
         
-        # Local / remote / branch
-        self.local    = self.mkdir('{0}/{1}/{2}'.format(self.workspace, attrs.get('git-local', 'src/{0}'.format(project)), project))
+        # Remote / branch / other branches are worktrees of the primary clone
         self.remote   = attrs.get('git-remote')
-        self.branch   = attrs.get('git-branch')
+        self.branch   = branch or attrs.get('git-branch')
+        self.worktree = not self.branch == attrs.get('git-branch')
+        self.label    = project if not self.worktree else '{0}@{1}'.format(project, self.branch)
+        self.local    = self.mkdir('{0}/{1}'.format(self.project_root(project, attrs, self.branch), project))
+        
+        # Clone depth / single branch / partial clone filter
+        defaults      = self.config.get('GIT', {})
+        self.depth    = int(attrs.get('git-depth', defaults.get('depth', 0)))
+        self.single   = attrs.get('git-single-branch', defaults.get('single-branch', False))
+        self.filter   = attrs.get('git-filter', defaults.get('filter', None))
 
         # Repo / Git objects
         self._repo    = None
@@ -33,6 +76,12 @@ class DevToolsGitRepo(DevToolsCommon):
         # Has the repo been updated / cloned
         self.updated  = False
         self.cloned   = False
+        
+        # Commit the local branch was on before updating
+        self.previous = None
+        
+        # Updated ahead of the build by a concurrent sync
+        self.synced   = False
 
     def _exists(self):
         """
@@ -64,13 +113,68 @@ class DevToolsGitRepo(DevToolsCommon):
         self._git.checkout(branch)
         return self.feedback.success('Switched to branch: {0}'.format(branch))
     
+    def _clone_opts(self):
+        """
+        Build the options for cloning the remote repository.
+        
+        :rtype: dict
+        """
+        opts = {'branch': self.branch}
+        if self.depth:
+            opts['depth'] = self.depth
+        if self.single:
+            opts['single_branch'] = True
+        if self.filter:
+            opts['filter'] = self.filter
+        return opts
+    
+    def _refspec(self):
+        """
+        Refspec to fetch only the configured branch.
+        
+        :rtype: str
+        """
+        return '+refs/heads/{0}:refs/remotes/origin/{0}'.format(self.branch)
+    
+    def _lock(self):
+        """
+        Return the lock guarding this project's primary clone.
+        
+        :rtype: RLock
+        """
+        with self._locks_lock:
+            return self._locks.setdefault(self.name, RLock())
+    
+    def _add_worktree(self):
+        """
+        Check out the branch as a worktree of the primary clone, sharing its
+        object database.
+        """
+        with self._lock():
+            primary = DevToolsGitRepo(self.name, self.attrs, automode=self.automode)
+            primary._clone()
+            
+            # Fetch the branch into the shared repository and add the worktree
+            git = Git(primary.local)
+            git.fetch('origin', self._refspec())
+            git.worktree('add', '-B', self.branch, self.local, 'origin/{0}'.format(self.branch))
+    
+    @timed('clone')
     def _clone(self):
         """
         Clone a remote repository.
         """
-        if not self._exists():
-            Repo.clone_from(self.remote, self.local)
-            self.feedback.success('Cloned repository')
+        with self._lock():
+            exists = self._exists()
+            if not exists:
+                if self.worktree:
+                    self._add_worktree()
+                else:
+                    Repo.clone_from(self.remote, self.local, **self._clone_opts())
+        
+        # Newly cloned
+        if not exists:
+            self.feedback.success('Cloned repository' if not self.worktree else 'Added worktree for branch: {0}'.format(self.branch))
             self.feedback.info('Remote: {0}'.format(self.remote))
             self.feedback.info('Local: {0}'.format(self.local))
 
@@ -86,16 +190,18 @@ class DevToolsGitRepo(DevToolsCommon):
         else:
             self.feedback.info('Local repository found: {0}'.format(self.local))
 
+    @timed('fetch')
     def _refresh(self):
         """
-        Refresh the repository objects.
+        Refresh the repository objects, reusing open handles.
         """
-        self._git  = Git(self.local)
-        self._repo = Repo(self.local)
+        if not self._repo:
+            self._git  = Git(self.local)
+            self._repo = Repo(self.local)
 
-        # Fetch remotes
-        self._repo.remotes.origin.fetch()
-        self.feedback.info('Fetched changes from remote')
+        # Fetch the configured branch (shallow and partial clones keep their boundary/filter)
+        self._repo.remotes.origin.fetch(self._refspec())
+        self.feedback.info('Fetched changes from remote: {0}'.format(self.branch))
 
     def _get_local_commit(self):
         """
@@ -113,6 +219,39 @@ class DevToolsGitRepo(DevToolsCommon):
             if o.remote_head == self.branch:
                 return o.commit
 
+    def ls_remote(self):
+        """
+        Query the remote for the head of the configured branch without
+        touching the local repository.
+        
+        :rtype: str|None
+        """
+        code, out, err = self.shell(['git', 'ls-remote', self.remote, 'refs/heads/{0}'.format(self.branch)], stdout=True)
+        if not code == 0 or not out.strip():
+            return None
+        return out.split()[0]
+    
+    def local_head(self):
+        """
+        Read the head of the local branch without loading the repository.
+        
+        :rtype: str|None
+        """
+        if not self._exists():
+            return None
+        code, out, err = self.shell(['git', 'rev-parse', '--verify', '-q', 'refs/heads/{0}'.format(self.branch)], stdout=True, cwd=self.local)
+        return None if not code == 0 else out.strip()
+
+    def get_commit(self):
+        """
+        Get the commit SHA the local branch is on.
+        
+        :rtype: str|None
+        """
+        commit = self._get_local_commit()
+        return None if not commit else str(commit.hexsha)
+
+    @timed('pull')
     def _pull(self):
         """
         Pull changes from a remote repository.
@@ -141,12 +280,9 @@ class DevToolsGitRepo(DevToolsCommon):
         if remote_commit == local_commit:
             return self.feedback.info('Local matches remote, everything up to date'.format(local_commit, remote_commit))
 
-        # Update the local branch
-        origin = self._repo.remotes.origin
-        origin.pull()
-
-        # Refresh the branches
-        self._refresh()
+        # Update the local branch from the fetched remote branch
+        self.previous = str(local_commit.hexsha)
+        self._git.merge('--no-edit', 'origin/{0}'.format(self.branch))
 
         # Updated success
         self.feedback.success('Local branch updated -> {0}'.format(self._get_local_commit()))
@@ -156,9 +292,13 @@ class DevToolsGitRepo(DevToolsCommon):
         """
         Construct information about the repository.
         """
+        self.updated  = False
+        self.cloned   = False
+        self.previous = None
 
         # Make sure the repo exists locally
         self._clone()
 
         # Pull any changes from the remote
-        self._pull()
\ No newline at end of file
+        self._pull()
+        self.synced   = True
\ No newline at end of file
@@ -1,14 +1,23 @@
 from __future__ import print_function
 from getpass import getuser
+from multiprocessing.pool import ThreadPool
 from json import loads as json_loads
 from os import path, listdir, unlink, geteuid
 
 # Devtools Libraries
-from lense_devtools.dpkg import DevToolsDpkg
 from lense_devtools.args import DevToolsArgs
 from lense_devtools.common import DevToolsCommon
-from lense_devtools.gitrepo import DevToolsGitRepo
+from lense_devtools.gitrepo import DevToolsGitRepo, git_environment
 from lense_devtools.debuild import DevToolsDebuild
+from lense_devtools.preflight import DevToolsPreflight
+from lense_devtools.watcher import DevToolsWatcher
+from lense_devtools.scheduler import DevToolsScheduler
+from lense_devtools.timing import DevToolsTimer
+from lense_devtools.revisions import DevToolsRevisions
+from lense_devtools.publish import DevToolsPublisher
+from lense_devtools.retention import DevToolsRetention
+from lense_devtools.depgraph import DevToolsDepGraph
+from lense_devtools.daemon import DevToolsDaemon, DevToolsClient, socket_path
 
 class DevToolsInterface(DevToolsCommon):
     """
@@ -17,13 +26,66 @@ class DevToolsInterface(DevToolsCommon):
     def __init__(self):
         super(DevToolsInterface, self).__init__()
         
-        # Load arguments / dpkg handler
+        # Load arguments / dpkg handler (created on first use)
         self.args    = DevToolsArgs()
-        self.dpkg    = DevToolsDpkg()
+        self._dpkg   = None
+        
+        # Repository handlers, kept open across daemon jobs
+        self._gitrepos = {}
+        
+        # Shared connections / credentials for every git process
+        git_environment(self.config, self.workspace)
         
         # Main command
         self.command = self.args.get('command')
         
+    @property
+    def dpkg(self):
+        """
+        Create the dpkg handler on first use, only the install command needs it.
+        
+        :rtype: DevToolsDpkg
+        """
+        if self._dpkg is None:
+            
+            # Deferred import, python-apt initializes apt_pkg on import
+            from lense_devtools.dpkg import DevToolsDpkg
+            self._dpkg = DevToolsDpkg()
+        return self._dpkg
+        
+    def gitrepo(self, project, branch=None):
+        """
+        Return the repository handler for a build target, reusing open handlers.
+        
+        :param project: The project name
+        :type  project: str
+        :param  branch: The branch, defaults to <git-branch>
+        :type   branch: str
+        :rtype: DevToolsGitRepo
+        """
+        key = (project, branch or self.projects[project]['git-branch'])
+        if not key in self._gitrepos:
+            self._gitrepos[key] = DevToolsGitRepo(project, self.projects[project], branch=branch)
+        return self._gitrepos[key]
+        
+    def targets(self, projects):
+        """
+        Return the build targets for a list of projects: the configured
+        <git-branch> plus any additional <git-branches>.
+        
+        :param projects: The project names
+        :type  projects: list
+        :rtype: list
+        """
+        targets = []
+        for p in sorted(projects):
+            primary = self.projects[p]['git-branch']
+            targets.append((p, p, primary))
+            for b in self.projects[p].get('git-branches', ()):
+                if not b == primary:
+                    targets.append(('{0}@{1}'.format(p, b), p, b))
+        return targets
+        
     def _init_config(self, file):
         """
         Load and validate the workspace init config file. This assumes
@@ -91,7 +153,7 @@ class DevToolsInterface(DevToolsCommon):
         else:
             self.die('Workspace <{0}> not found, please create and set appropriate permissions'.format(self.workspace))
         
-    def _summarize(self, project, attrs):
+    def _summarize(self, project, attrs, branch=None):
         """
         Display a build summary.
         
@@ -99,52 +161,58 @@ class DevToolsInterface(DevToolsCommon):
         :type  project: str
         :param   attrs: Project attributes
         :type    attrs: dict
+        :param  branch: The branch being built
+        :type   branch: str
         """
         self.feedback.block([
             'PROJECT: {0}'.format(project),
             'REMOTE:  {0}'.format(attrs.get('git-remote')),
-            'BRANCH:  {0}'.format(attrs.get('git-branch')),
+            'BRANCH:  {0}'.format(branch or attrs.get('git-branch')),
             'LOCAL:   {0}'.format(attrs.get('git-local', '{0}/src/{1}'.format(self.workspace, project))),
             'VERSION: {0}'.format(attrs.get('version'))
         ], 'BUILD')
         
-    def _install_pkg(self, project):
+    def _project_pkg(self, project):
         """
-        Install a debian package.
+        Return the current debian package for a project if it exists.
         
         :param project: The project name
         :type  project: str
+        :rtype: str|None
         """
         project_pkg = path.expanduser('~/.lense_devtools/build/current/{0}_current_all.deb'.format(project))
-        if path.isfile(project_pkg):
-            self.dpkg.installdeb(project_pkg)
+        return project_pkg if path.isfile(project_pkg) else None
         
     def _install(self):
         """
         Install or upgrade all or specific packages in the current builds directory.
         """
         use_projects = self.args.get('projects', None)
-        pkg_order    = ['lense-common', 'lense-client', 'lense-engine', 'lense-portal', 'lense-socket']
+        pkg_order    = DevToolsDepGraph().order(self.projects.keys())
         
         # Must be superuser
         if not geteuid() == 0:
             self.die('Command <install> must be run as superuser')
         
-        # Installing all projects
-        if not use_projects:
-            for project in pkg_order:
-                self._install_pkg(project)
-        
         # Install specific projects
-        else:
+        if use_projects:
             use_projects = self.validate_projects(use_projects[0].split(','))
-    
-            # Install projects in order
-            for project in pkg_order:
-                if project in use_projects:
-                    self._install_pkg(project)
+            pkg_order    = [p for p in pkg_order if p in use_projects]
+            
+        # Resolve packages in order
+        pkgs = [pkg for pkg in [self._project_pkg(p) for p in pkg_order] if pkg]
+        
+        # Install all packages in one transaction
+        if self.args.get('batch', False):
+            with DevToolsTimer.phase('all', 'install'):
+                return self.dpkg.installdebs(pkgs)
+        
+        # Install packages one at a time
+        for pkg in pkgs:
+            with DevToolsTimer.phase(path.basename(pkg).split('_')[0], 'install'):
+                self.dpkg.installdeb(pkg)
         
-    def _build_project(self, project, attrs):
+    def _build_project(self, project, attrs, branch=None, force=False):
         """
         Build a single project.
         
@@ -152,18 +220,29 @@ class DevToolsInterface(DevToolsCommon):
         :type  project: str
         :param   attrs: Project attributes
         :type    attrs: dict
+        :param  branch: The branch to build, defaults to <git-branch>
+        :type   branch: str
+        :param   force: Build even if the source has not changed
+        :type    force: bool
         """
-        self._summarize(project, attrs)
+        self._summarize(project, attrs, branch)
         
-        # Setup the source code repositry
-        gitrepo = DevToolsGitRepo(project, attrs, automode=self.args.get('auto', False))
-        gitrepo.setup()
+        # Setup the source code repositry (unless already synced for this build)
+        gitrepo = self.gitrepo(project, branch)
+        gitrepo.automode = self.args.get('auto', False)
+        if not gitrepo.synced:
+            gitrepo.setup()
+        gitrepo.synced = False
 
-        # Has the repo been newly cloned or updated
-        build = False if not (gitrepo.cloned or gitrepo.updated) else True
+        # Has the repo been newly cloned or updated / has the tree moved since the last build
+        # (uncommitted edits on top of the built commit are local, the commit does not describe the tree)
+        commit  = gitrepo.get_commit()
+        index   = self.tree_index(project, attrs, branch)
+        moved, local = (False, False) if gitrepo.cloned or gitrepo.updated or not index else index.status(commit)
+        build   = False if not (gitrepo.cloned or gitrepo.updated or moved or force) else True
 
         # Setup the build handler
-        DevToolsDebuild(project, attrs, build=build, automode=self.args.get('auto', False)).run()
+        DevToolsDebuild(project, attrs, build=build, automode=self.args.get('auto', False), commit=commit, since=gitrepo.previous, branch=branch, local=local, force=force).run()
         return True
         
     def _build_status(self, status):
@@ -178,31 +257,132 @@ class DevToolsInterface(DevToolsCommon):
         for p,s in status.iteritems():
             fb = getattr(self.feedback, 'error' if not s else 'success', 'info')
             fb(error.format(p) if not s else success.format(p))
+            
+        # Show where the build spent its time
+        if DevToolsTimer.records():
+            self.feedback.block(DevToolsTimer.table(), 'TIMING')
+        
+    def _sync_target(self, target):
+        """
+        Clone or update the repository of a build target.
+        
+        :param target: The (key, project, branch) build target
+        :type  target: tuple
+        """
+        key, project, branch = target
+        gitrepo = self.gitrepo(project, branch)
+        gitrepo.automode = self.args.get('auto', False)
+        try:
+            gitrepo.setup()
+        
+        # Retried (and reported) when the target is built
+        except Exception as e:
+            self.feedback.error('Failed to sync <{0}>: {1}'.format(key, str(e)))
+        
+    def _sync(self, targets):
+        """
+        Clone or update the repositories of all build targets concurrently,
+        at most <GIT.concurrency> at a time. Primary branches go first, so a
+        fresh primary clone is made (and reported as cloned) by its own
+        handler rather than as a side effect of adding a worktree.
+        
+        :param targets: The (key, project, branch) build targets
+        :type  targets: list
+        """
+        if not targets:
+            return None
+        pool = ThreadPool(self.git_pool_size(len(targets)))
+        try:
+            for primary in [True, False]:
+                pool.map(self._sync_target, [t for t in targets if (t[0] == t[1]) == primary])
+        finally:
+            pool.close()
+            pool.join()
+        
+    def _reverse_depends(self, graph, targets, plan):
+        """
+        Return the unchanged targets depending on a changed target of the
+        same branch, which are rebuilt when <DEPENDS.rebuild-reverse> is set.
+        
+        :param   graph: The project dependency graph
+        :type    graph: DevToolsDepGraph
+        :param targets: The (key, project, branch) build targets
+        :type  targets: list
+        :param    plan: Target/changed key pairs
+        :type     plan: dict
+        :rtype: set
+        """
+        if not self.config.get('DEPENDS', {}).get('rebuild-reverse', False):
+            return set()
+        forced = set()
+        for branch in set(t[2] for t in targets):
+            changed = [p for k,p,b in targets if b == branch and plan[k]]
+            rdeps   = graph.rdepends(changed)
+            forced.update(k for k,p,b in targets if b == branch and p in rdeps and not plan[k])
+        for k in sorted(forced):
+            self.feedback.info('Rebuilding <{0}>, a dependency changed'.format(k))
+        return forced
         
     def _build(self):
         """
         Build either all projects or specified projects.
         """
         use_projects = self.args.get('projects', None)
+        jobs         = self.args.get('jobs', 1)
         
-        # Building all projects
-        if not self.args.get('projects', None):
-            status = {}
-            for p,a in self.projects.iteritems():
-                status[p] = self._build_project(p,a)
-            self._build_status(status)
-            return True
-             
-        # Building specific projects
-        targets = self.validate_projects(use_projects[0].split(','))
-    
-        # Build each project
-        self._build_status({p: self._build_project(p, self.projects[p]) for p in targets})
+        # Building all projects or specific projects
+        targets = self.projects.keys() if not use_projects else self.validate_projects(use_projects[0].split(','))
+        
+        # Parallel builds cannot prompt for input
+        if jobs > 1 and not self.args.get('auto', False):
+            self.feedback.info('Building {0} projects in parallel, enabling automated mode'.format(jobs))
+            self.args.set('auto', True)
+        
+        # Build targets for every configured branch, in dependency order
+        graph   = DevToolsDepGraph()
+        order   = graph.order(self.projects.keys())
+        targets = sorted(self.targets(targets), key=lambda t: order.index(t[1]))
+        keys    = [t[0] for t in targets]
+        
+        # Check all remotes up front, unchanged targets are skipped entirely
+        plan    = DevToolsPreflight(targets).plan()
+        forced  = self._reverse_depends(graph, targets, plan)
+        skipped = dict((k, True) for k in keys if not plan[k] and not k in forced)
+        
+        # Show which projects can build together
+        changed = [p for k,p,b in targets if not k in skipped]
+        for i, wave in enumerate(graph.waves(set(changed))):
+            self.feedback.info('Build wave {0}: {1}'.format(i + 1, ', '.join(wave)))
+        
+        # Update every changed repository up front, in parallel
+        self._sync([t for t in targets if not t[0] in skipped])
+        
+        # Schedule each changed target after its dependencies (on the same branch if also built)
+        scheduler = DevToolsScheduler(jobs)
+        for k,p,b in targets:
+            if not k in skipped:
+                depends = ['{0}@{1}'.format(d, b) if '{0}@{1}'.format(d, b) in keys else d for d in graph.depends(p)]
+                
+                # Worktrees share the primary clone, which must be set up by its own target first
+                if not k == p and not p in skipped:
+                    depends.append(p)
+                scheduler.add(k, self._build_project, (p, self.projects[p], b, k in forced), depends=depends)
+        
+        # Unchanged projects count as successful
+        status = scheduler.run()
+        status.update(skipped)
+        self._build_status(status)
+        
+        # Apply the retention policy after building
+        if self.config.get('GC', {}).get('post-build', False):
+            DevToolsRetention(targets).run()
+        return status
     
     def _list(self):
         """
         List all projects and attributes found in configuration.
         """
+        graph = DevToolsDepGraph()
         print('')
         for p,a in self.projects.iteritems():
             print('PROJECT: {0}'.format(p))
@@ -210,7 +390,101 @@ class DevToolsInterface(DevToolsCommon):
             print('> Remote:   {0}'.format(a['git-remote']))
             print('> Branch:   {0}'.format(a['git-branch']))
             print('> Local:    {0}'.format(a['git-local']))
-            print('> Revision: {0}\n'.format())
+            print('> Depends:  {0}'.format(', '.join(graph.depends(p)) or 'none'))
+            
+            # Latest revision from the project revision store
+            root   = '{0}/{1}'.format(self.workspace, a['git-local'])
+            latest = None if not path.isdir(root) else DevToolsRevisions(root).latest()
+            if not latest:
+                print('> Revision: none\n')
+            else:
+                print('> Revision: {0} ({1}, commit {2})\n'.format(latest['revision'], latest['timestamp'], latest['commit_sha'] or 'unknown'))
+    
+    def _report(self, command):
+        """
+        Write the timing report for build/install runs.
+        
+        :param command: The command that was run
+        :type  command: str
+        """
+        if command in ['build', 'install'] and DevToolsTimer.records():
+            self.mkdir('{0}/reports'.format(self.workspace))
+            self.feedback.info('Timing report: {0}'.format(DevToolsTimer.report(self.workspace, command)))
+    
+    def run_job(self, command, projects, options):
+        """
+        Run a build/install job submitted to the daemon.
+        
+        :param  command: The command to run (build, install)
+        :type   command: str
+        :param projects: The projects to run the command for
+        :type  projects: list
+        :param  options: Command options (auto, jobs, batch)
+        :type   options: dict
+        """
+        self.args.set('projects', [','.join(projects)])
+        for k,v in options.iteritems():
+            self.args.set(k, v)
+        
+        # Each job gets its own timing report
+        DevToolsTimer.reset()
+        try:
+            return (self._build if command == 'build' else self._install)()
+        finally:
+            self._report(command)
+    
+    def _submit(self):
+        """
+        Submit the current command to a running daemon.
+        """
+        use_projects = self.args.get('projects', None)
+        return DevToolsClient(socket_path(self.config, self.workspace)).submit({
+            'command':  self.command,
+            'projects': None if not use_projects else self.validate_projects(use_projects[0].split(',')),
+            'jobs':     self.args.get('jobs', 1),
+            'batch':    self.args.get('batch', False)
+        })
+    
+    def _watch(self):
+        """
+        Watch project remotes and build projects whose branch moved.
+        """
+        use_projects = self.args.get('projects', None)
+        targets      = sorted(self.projects.keys()) if not use_projects else self.validate_projects(use_projects[0].split(','))
+        options      = {'auto': True, 'jobs': self.args.get('jobs', 1), 'batch': False}
+        
+        # Build in process or hand the build to a running daemon
+        def trigger(projects):
+            if self.args.get('daemon', False):
+                return DevToolsClient(socket_path(self.config, self.workspace)).submit(dict(options, command='build', projects=projects, wait=False))
+            return self.run_job('build', projects, options)
+        DevToolsWatcher(self.targets(targets), trigger).run()
+    
+    def _export(self):
+        """
+        Export the current packages as a single consistent snapshot.
+        """
+        try:
+            DevToolsPublisher('{0}/build'.format(self.workspace)).snapshot(self.args.get('output', None))
+        except Exception as e:
+            self.die(str(e))
+    
+    def _gc(self):
+        """
+        Apply the retention policy to all or specific projects.
+        """
+        use_projects = self.args.get('projects', None)
+        targets      = self.projects.keys() if not use_projects else self.validate_projects(use_projects[0].split(','))
+        DevToolsRetention(self.targets(targets)).run()
+    
+    def _serve(self):
+        """
+        Run the devtools daemon.
+        """
+        try:
+            DevToolsDaemon(self).serve()
+        except Exception as e:
+            self.die(str(e))
     
     def _run(self):
         """
@@ -218,15 +492,28 @@ class DevToolsInterface(DevToolsCommon):
         """
         self._init_workspace()
         
+        # Hand the job to a running daemon
+        if self.args.get('daemon', False) and self.command in ['build', 'install']:
+            if not self._submit():
+                self.die('Daemon job failed')
+            return None
+        
         # Command mapper
         mapper = {
             'build': self._build,
+            'export': self._export,
+            'gc': self._gc,
             'install': self._install,
-            'list': self._list
+            'list': self._list,
+            'serve': self._serve,
+            'watch': self._watch
         }
         
         # Run the command
-        mapper[self.command]()
+        try:
+            mapper[self.command]()
+        finally:
+            self._report(self.command)
         
     @staticmethod
     def run():
@@ -0,0 +1,130 @@
+from re import compile
+from shutil import rmtree
+from os import path, makedirs, listdir, unlink
+
+# Patches generated by devtools: patch_<revision>
+DEVTOOLS_PATCH = compile(r'^patch_[a-zA-Z]+[0-9]+$')
+
+class DevToolsQuiltPatches(object):
+    """
+    Manage the devtools generated quilt patches of a project source tree.
+    """
+    def __init__(self, src):
+        """
+        :param src: The project source directory
+        :type  src: str
+        """
+        self.src     = src
+        self.pdir    = '{0}/debian/patches'.format(src)
+        self.series  = '{0}/series'.format(self.pdir)
+        self.pc      = '{0}/.pc'.format(src)
+        self.applied = '{0}/applied-patches'.format(self.pc)
+
+    def _read(self, file):
+        """
+        Read a list file, one entry per line.
+
+        :rtype: list
+        """
+        if not path.isfile(file):
+            return []
+        with open(file, 'r') as f:
+            return [l.strip() for l in f if l.strip()]
+
+    def _write(self, file, entries):
+        """
+        Write a list file, one entry per line.
+        """
+        with open(file, 'w') as f:
+            f.write(''.join('{0}\n'.format(e) for e in entries))
+
+    def generated(self):
+        """
+        Return the generated patches in the series.
+
+        :rtype: list
+        """
+        return [p for p in self._read(self.series) if DEVTOOLS_PATCH.match(p)]
+
+    def stack_size(self):
+        """
+        Return the total size in bytes of the generated patches.
+
+        :rtype: int
+        """
+        return sum(path.getsize('{0}/{1}'.format(self.pdir, p)) for p in self.generated() if path.isfile('{0}/{1}'.format(self.pdir, p)))
+
+    def add(self, name, diff):
+        """
+        Add a patch that is already applied to the source tree. The patch is
+        appended to the series and recorded as applied for dpkg-source.
+
+        :param name: The patch name
+        :type  name: str
+        :param diff: The patch contents
+        :type  diff: str
+        """
+        for d in [self.pdir, self.pc]:
+            if not path.isdir(d):
+                makedirs(d)
+        with open('{0}/{1}'.format(self.pdir, name), 'w') as f:
+            f.write(diff)
+
+        # Quilt state files used by dpkg-source
+        for file, value in [('.version', '2'), ('.quilt_patches', 'debian/patches'), ('.quilt_series', 'series')]:
+            if not path.isfile('{0}/{1}'.format(self.pc, file)):
+                self._write('{0}/{1}'.format(self.pc, file), [value])
+
+        # Append to the series and mark as applied
+        self._write(self.series, [p for p in self._read(self.series) if not p == name] + [name])
+        self._write(self.applied, [p for p in self._read(self.applied) if not p == name] + [name])
+
+    def remove(self, name):
+        """
+        Remove a patch left by an unfinished build. Its changes stay in the
+        source tree and are picked up by the next generated patch.
+
+        :param name: The patch name
+        :type  name: str
+        :rtype: bool
+        """
+        found = False
+        for p in ['{0}/{1}'.format(self.pdir, name), '{0}/{1}'.format(self.pc, name)]:
+            if path.isdir(p):
+                rmtree(p)
+                found = True
+            elif path.isfile(p):
+                unlink(p)
+                found = True
+        if path.isfile(self.series):
+            self._write(self.series, [p for p in self._read(self.series) if not p == name])
+        if path.isfile(self.applied):
+            self._write(self.applied, [p for p in self._read(self.applied) if not p == name])
+        return found
+
+    def clear(self):
+        """
+        Remove all generated patches, leaving any other patches in place.
+
+        :rtype: int
+        """
+        generated = set(p for p in listdir(self.pdir) if DEVTOOLS_PATCH.match(p)) if path.isdir(self.pdir) else set()
+        generated.update(self.generated())
+        for name in generated:
+            for p in ['{0}/{1}'.format(self.pdir, name), '{0}/{1}'.format(self.pc, name)]:
+                if path.isdir(p):
+                    rmtree(p)
+                elif path.isfile(p):
+                    unlink(p)
+
+        # Drop the patches from the series and applied list
+        if path.isfile(self.series):
+            self._write(self.series, [p for p in self._read(self.series) if not p in generated])
+        applied = [p for p in self._read(self.applied) if not p in generated]
+        if applied:
+            self._write(self.applied, applied)
+
+        # No patches left applied, quilt state is no longer needed
+        elif path.isdir(self.pc):
+            rmtree(self.pc)
+        return len(generated)
@@ -0,0 +1,88 @@
+from multiprocessing.pool import ThreadPool
+from lense_devtools.timing import DevToolsTimer
+from lense_devtools.common import DevToolsCommon
+from lense_devtools.gitrepo import DevToolsGitRepo
+from lense_devtools.checkpoint import DevToolsCheckpoint
+
+class DevToolsPreflight(DevToolsCommon):
+    """
+    Check all project remotes concurrently before building.
+    """
+    def __init__(self, targets):
+        """
+        :param targets: The (key, project, branch) build targets to check
+        :type  targets: list
+        """
+        super(DevToolsPreflight, self).__init__()
+
+        # Targets to check
+        self.targets = list(targets)
+
+    def _check(self, target):
+        """
+        Run a timed remote/local comparison for a build target.
+
+        :param target: The (key, project, branch) build target
+        :type  target: tuple
+        :rtype: tuple
+        """
+        with DevToolsTimer.phase(target[0], 'preflight'):
+            return self._compare(*target)
+
+    def _compare(self, key, project, branch):
+        """
+        Compare the remote branch head with the local branch head.
+
+        :param     key: The build target key
+        :type      key: str
+        :param project: The project name
+        :type  project: str
+        :param  branch: The branch to compare
+        :type   branch: str
+        :rtype: tuple
+        """
+        gitrepo = DevToolsGitRepo(project, self.projects[project], branch=branch)
+        local   = gitrepo.local_head()
+
+        # No local repository, needs a clone
+        if not local:
+            return key, True, 'not cloned'
+
+        # Unfinished build to resume
+        if DevToolsCheckpoint(self.project_root(project, self.projects[project], branch)).pending():
+            return key, True, 'resuming unfinished build'
+
+        # Remote could not be queried, fall back to a full update
+        remote = gitrepo.ls_remote()
+        if not remote:
+            return key, True, 'remote query failed'
+        if not remote == local:
+            return key, True, '{0} -> {1}'.format(local[:8], remote[:8])
+        
+        # Local edits to the working tree since the last build
+        index = self.tree_index(project, self.projects[project], branch)
+        if index and index.changed(local):
+            return key, True, 'local changes at {0}'.format(local[:8])
+        return key, False, 'up to date at {0}'.format(local[:8])
+
+    def plan(self):
+        """
+        Return a dict of target/changed key pairs.
+
+        :rtype: dict
+        """
+        if not self.targets:
+            return {}
+        pool = ThreadPool(self.git_pool_size(len(self.targets)))
+        try:
+            results = pool.map(self._check, self.targets)
+        finally:
+            pool.close()
+            pool.join()
+
+        # Show the plan
+        plan = {}
+        for key, changed, reason in results:
+            plan[key] = changed
+            self.feedback.info('Preflight <{0}>: {1} ({2})'.format(key, 'changed' if changed else 'unchanged', reason))
+        return plan
@@ -0,0 +1,143 @@
+from time import strftime
+from fcntl import flock, LOCK_EX, LOCK_SH, LOCK_UN
+from os import path, listdir, readlink, rename
+from lense_devtools.common import DevToolsCommon
+
+class DevToolsPublisher(DevToolsCommon):
+    """
+    Publish built packages to the build output directory. The current package
+    links are swapped atomically, so a concurrent install sees either the old
+    or the new package.
+    """
+    def __init__(self, broot):
+        """
+        :param broot: The build output directory
+        :type  broot: str
+        """
+        super(DevToolsPublisher, self).__init__()
+
+        # Build output directory / current package links / snapshots
+        self.broot     = broot
+        self.cdir      = '{0}/current'.format(broot)
+        self.sdir      = '{0}/snapshots'.format(broot)
+
+        # Serializes link swaps against snapshot exports
+        self.lockfile  = '{0}/.current.lock'.format(broot)
+
+    def current(self, project):
+        """
+        Return the current package link for a project.
+
+        :param project: The project name
+        :type  project: str
+        :rtype: str
+        """
+        return '{0}/{1}_current_all.deb'.format(self.cdir, project)
+
+    def _lock(self, mode):
+        """
+        Open and lock the current links lock file.
+
+        :param mode: LOCK_SH or LOCK_EX
+        :type  mode: int
+        :rtype: file
+        """
+        self.mkdir(self.broot)
+        lock = open(self.lockfile, 'a')
+        flock(lock.fileno(), mode)
+        return lock
+
+    def _unlock(self, lock):
+        """
+        Release and close the current links lock file.
+
+        :param lock: The locked file
+        :type  lock: file
+        """
+        flock(lock.fileno(), LOCK_UN)
+        lock.close()
+
+    def link(self, project, target):
+        """
+        Point the current package for a project at a package.
+
+        :param project: The project name
+        :type  project: str
+        :param  target: The package
+        :type   target: str
+        :rtype: str
+        """
+        self.mkdir(self.cdir)
+        link = self.current(project)
+        lock = self._lock(LOCK_SH)
+        try:
+            self.swaplink(target, link)
+        finally:
+            self._unlock(lock)
+        return link
+
+    def publish(self, project, debpath, bdir):
+        """
+        Move a built package into its revision directory and make it the
+        current package for the project.
+
+        :param project: The project name
+        :type  project: str
+        :param debpath: The built package
+        :type  debpath: str
+        :param    bdir: The revision build directory
+        :type     bdir: str
+        :rtype: str
+        """
+        latest = '{0}/{1}'.format(bdir, path.basename(debpath))
+        self.placefile(debpath, latest)
+        self.link(project, latest)
+        return latest
+
+    def _resolve(self):
+        """
+        Return the packages the current links point to, keyed by link name.
+
+        :rtype: dict
+        """
+        if not path.isdir(self.cdir):
+            return {}
+        packages = {}
+        for name in listdir(self.cdir):
+            link = '{0}/{1}'.format(self.cdir, name)
+            if name.endswith('_current_all.deb') and path.islink(link):
+                target = readlink(link)
+                if path.isfile(target):
+                    packages[name] = target
+        return packages
+
+    def snapshot(self, dest=None):
+        """
+        Export every current package into a directory as one consistent set.
+        Packages are hardlinked where possible, the directory is staged and
+        renamed into place once complete.
+
+        :param dest: The snapshot directory, defaults to <build>/snapshots/<timestamp>
+        :type  dest: str
+        :rtype: str
+        """
+        dest = dest or '{0}/{1}'.format(self.sdir, strftime('%Y%m%d%H%M%S'))
+        if path.exists(dest):
+            raise Exception('Snapshot directory <{0}> already exists'.format(dest))
+
+        # Hold off link swaps while the set is resolved and linked
+        staging = self.mkdir('{0}.partial'.format(dest.rstrip('/')))
+        lock    = self._lock(LOCK_EX)
+        try:
+            packages = self._resolve()
+            for name, target in packages.iteritems():
+                self.linkfile(target, '{0}/{1}'.format(staging, path.basename(target)))
+        finally:
+            self._unlock(lock)
+        rename(staging, dest)
+
+        # Default snapshots are also available as <snapshots>/latest
+        if dest.startswith(self.sdir):
+            self.swaplink(dest, '{0}/latest'.format(self.sdir))
+        self.feedback.success('Exported {0} current package(s) to: {1}'.format(len(packages), dest))
+        return dest
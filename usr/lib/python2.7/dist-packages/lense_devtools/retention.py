@@ -0,0 +1,306 @@
+from shutil import rmtree
+from re import compile, escape
+from os import path, listdir, walk, unlink, rmdir, stat, lstat
+from lense_devtools.common import DevToolsCommon
+from lense_devtools.aptrepo import DevToolsAptRepo
+from lense_devtools.revisions import DevToolsRevisions
+
+# Build output directories that never hold revision packages
+RESERVED_DIRS = ['current', 'snapshots', 'repo']
+
+# Debuild by-products left in the project root
+BYPRODUCTS    = r'(\.dsc|\.debian\.tar\.[a-z0-9]+|_[a-z0-9]+\.(changes|build|buildinfo))'
+
+class DevToolsRetention(DevToolsCommon):
+    """
+    Apply the workspace retention policy to build output, the APT repository
+    pool, the artifact cache and project roots. Files referenced by a live
+    symbolic link, or hardlinked to one, are never removed. Exported
+    snapshots are left alone and their links do not count as reclaimable.
+    """
+    def __init__(self, targets):
+        """
+        :param targets: The (key, project, branch) build targets to collect
+        :type  targets: list
+        """
+        super(DevToolsRetention, self).__init__()
+
+        # Targets to collect
+        self.targets  = list(targets)
+
+        # Retention settings
+        settings      = self.config.get('GC', {})
+        self.keep     = max(1, int(settings.get('keep-revisions', 5)))
+        self.maxbytes = int(settings.get('max-size-mb', 0)) * 1024 * 1024
+
+        # Artifact cache root
+        self.cdir     = '{0}/cache/artifacts'.format(self.workspace)
+
+    def _inode(self, fpath):
+        """
+        Return the device/inode pair of a file, following symbolic links.
+
+        :param fpath: The file path
+        :type  fpath: str
+        :rtype: tuple|None
+        """
+        try:
+            st = stat(fpath)
+        except OSError:
+            return None
+        return (st.st_dev, st.st_ino)
+
+    def _referenced(self, broots):
+        """
+        Return the inodes of every file a symbolic link in the build output
+        points to. Hardlinked copies of those files are in use as well.
+
+        :param broots: The build output directories
+        :type  broots: set
+        :rtype: set
+        """
+        referenced = set()
+        for broot in broots:
+            for root, dirs, files in walk(broot):
+                for name in dirs + files:
+                    fpath = path.join(root, name)
+                    if path.islink(fpath):
+                        referenced.add(self._inode(fpath))
+        referenced.discard(None)
+        return referenced
+
+    def _cached(self):
+        """
+        Return the packages in the artifact cache keyed by inode.
+
+        :rtype: dict
+        """
+        cached = {}
+        if not path.isdir(self.cdir):
+            return cached
+        for key in listdir(self.cdir):
+            edir = '{0}/{1}'.format(self.cdir, key)
+            if not path.isdir(edir):
+                continue
+            for f in listdir(edir):
+                if f.endswith('.deb'):
+                    cached.setdefault(self._inode('{0}/{1}'.format(edir, f)), []).append('{0}/{1}'.format(edir, f))
+        cached.pop(None, None)
+        return cached
+
+    def _kept(self, root):
+        """
+        Return the revisions to keep for a project root, newest first.
+
+        :param root: The project root
+        :type  root: str
+        :rtype: list
+        """
+        if not path.isfile('{0}/revisions.db'.format(root)):
+            return []
+        return [r['revision'] for r in DevToolsRevisions(root).history(self.keep)]
+
+    def _packages(self, broot, project):
+        """
+        Return the copies of every package built for a project, in the
+        revision directories and the APT repository pool, keyed by file name.
+
+        :param   broot: The build output directory
+        :type    broot: str
+        :param project: The project name
+        :type  project: str
+        :rtype: dict
+        """
+        pattern  = compile(r'^{0}_[^_]+-([^_-]+)_all\.deb$'.format(escape(project)))
+        packages = {}
+        if not path.isdir(broot):
+            return packages
+        dirs = ['{0}/{1}'.format(broot, d) for d in listdir(broot) if not d in RESERVED_DIRS]
+        dirs.append('{0}/repo/pool/{1}'.format(broot, project))
+        for bdir in dirs:
+            if path.islink(bdir) or not path.isdir(bdir):
+                continue
+            for f in listdir(bdir):
+                match = pattern.match(f)
+                if match:
+                    packages.setdefault(f, {'revision': match.group(1), 'paths': []})['paths'].append('{0}/{1}'.format(bdir, f))
+        return packages
+
+    def _sources(self, root, project, version, kept):
+        """
+        Return stale source tarballs and debuild by-products in a project root.
+
+        :param    root: The project root
+        :type     root: str
+        :param project: The project name
+        :type  project: str
+        :param version: The configured version
+        :type  version: str
+        :param    kept: The revisions to keep
+        :type     kept: list
+        :rtype: list
+        """
+        tarball   = '{0}_{1}.orig.{2}'.format(project, version, self.tarball_engine().extension)
+        orig      = compile(r'^{0}_[^_]+\.orig\.tar(\.[a-z0-9]+)?$'.format(escape(project)))
+        byproduct = compile(r'^{0}_[^_]+-([^_-]+?){1}$'.format(escape(project), BYPRODUCTS))
+        stale     = []
+        if not path.isdir(root):
+            return stale
+        for f in listdir(root):
+            if orig.match(f) and not f == tarball:
+                stale.append('{0}/{1}'.format(root, f))
+                continue
+            match = byproduct.match(f)
+            if match and kept and not match.group(1) in kept:
+                stale.append('{0}/{1}'.format(root, f))
+        return stale
+
+    def _sizes(self, paths):
+        """
+        Return the size of each distinct inode among a set of paths.
+
+        :param paths: The file paths
+        :type  paths: list
+        :rtype: dict
+        """
+        sizes = {}
+        for p in paths:
+            inode = self._inode(p)
+            if inode:
+                sizes[inode] = path.getsize(p)
+        return sizes
+
+    def _freed(self, group):
+        """
+        Return the bytes removing every path of a group would free: only
+        inodes with no links outside the group count.
+
+        :param group: The file paths
+        :type  group: list
+        :rtype: int
+        """
+        links = {}
+        for p in group:
+            try:
+                st = stat(p)
+            except OSError:
+                continue
+            inode = (st.st_dev, st.st_ino)
+            links[inode] = (links.get(inode, (0,))[0] + 1, st.st_nlink, st.st_size)
+        return sum(size for count, nlink, size in links.values() if nlink <= count)
+
+    def plan(self, referenced):
+        """
+        Return the groups of files to remove. A package is removed together
+        with its APT pool copy and artifact cache entry.
+
+        :param referenced: Inodes of symbolic link targets, never removed
+        :type  referenced: set
+        :rtype: list
+        """
+        cached = self._cached()
+        remove = []
+        kept   = []
+        inuse  = []
+        seen   = set()
+
+        # Groups with any link in use are kept whole
+        def grouped(paths):
+            group = list(paths)
+            for p in paths:
+                group.extend(cached.pop(self._inode(p), []))
+            if [p for p in group if self._inode(p) in referenced]:
+                inuse.extend(group)
+                return None
+            return group
+
+        for key, project, branch in self.targets:
+            attrs = self.projects[project]
+            root  = self.project_root(project, attrs, branch)
+            broot = self.build_root(attrs, branch)
+            if (root, broot) in seen:
+                continue
+            seen.add((root, broot))
+
+            # Last N revisions per project, everything older goes
+            revisions = self._kept(root)
+            for name, pkg in sorted(self._packages(broot, project).iteritems()):
+                group = grouped(pkg['paths'])
+                if not group:
+                    continue
+                if revisions and not pkg['revision'] in revisions:
+                    remove.append(group)
+                else:
+                    kept.append(group)
+            remove.extend([f] for f in self._sources(root, project, attrs.get('version'), revisions) if not self._inode(f) in referenced)
+
+        # Cached packages without a build copy left
+        for paths in cached.values():
+            group = grouped(paths)
+            if group:
+                kept.append(group)
+
+        # Oldest groups not in use go until the packages fit the size cap
+        kept.sort(key=lambda g: min(path.getmtime(p) for p in g))
+        if self.maxbytes:
+            total = sum(self._sizes(inuse + [p for g in kept for p in g]).values())
+            for group in list(kept):
+                if total <= self.maxbytes:
+                    break
+                total -= self._freed(group)
+                remove.append(group)
+                kept.remove(group)
+        return remove
+
+    def _remove(self, fpath):
+        """
+        Remove a file, or the whole entry of an artifact cache package.
+
+        :param fpath: The file path
+        :type  fpath: str
+        :rtype: int
+        """
+        try:
+            st = lstat(fpath)
+            if fpath.startswith('{0}/'.format(self.cdir)):
+                rmtree(path.dirname(fpath))
+            else:
+                unlink(fpath)
+        except OSError:
+            return None
+
+        # Space only comes back with the last link
+        return st.st_size if st.st_nlink == 1 else 0
+
+    def run(self):
+        """
+        Remove everything outside the retention policy and report the
+        reclaimed space.
+
+        :rtype: int
+        """
+        broots = set(self.build_root(self.projects[p], b) for k,p,b in self.targets)
+        remove = self.plan(self._referenced(broots))
+
+        # Remove in bulk, then drop emptied revision directories and pool entries
+        reclaimed = 0
+        removed   = 0
+        dirs      = set()
+        pool      = {}
+        for f in [f for group in remove for f in group]:
+            size = self._remove(f)
+            if size is None:
+                continue
+            reclaimed += size
+            removed   += 1
+            dirs.add(path.dirname(f))
+            for broot in broots:
+                if f.startswith('{0}/repo/'.format(broot)):
+                    pool.setdefault(broot, []).append(f[len('{0}/repo/'.format(broot)):])
+        for d in dirs:
+            if path.dirname(d) in broots and path.isdir(d) and not listdir(d):
+                rmdir(d)
+        for broot, filenames in pool.iteritems():
+            DevToolsAptRepo(broot).drop(filenames)
+        self.feedback.success('Removed {0} file(s), reclaimed {1:.1f} MB'.format(removed, reclaimed / 1048576.0))
+        return reclaimed
@@ -0,0 +1,160 @@
+import sqlite3
+from re import compile
+from os import path
+
+# Legacy revisions.txt line: <prefix><number>:: <timestamp>
+LEGACY_LINE = compile(r'^([a-zA-Z]*)([0-9]+)::\s*(.*)$')
+
+class DevToolsRevisions(object):
+    """
+    Revision history for a project, stored in an sqlite database in the
+    project root. Allocating a revision is a single locked transaction.
+    """
+    def __init__(self, root, prefix='dev'):
+        """
+        :param   root: The project root directory
+        :type    root: str
+        :param prefix: The revision prefix
+        :type  prefix: str
+        """
+        self.root   = root
+        self.prefix = prefix
+        self.db     = '{0}/revisions.db'.format(root)
+        self.legacy = '{0}/revisions.txt'.format(root)
+
+        # Create the schema and import any legacy history
+        self._init()
+
+    def _connect(self):
+        """
+        Open a connection in autocommit mode, transactions are explicit.
+
+        :rtype: sqlite3.Connection
+        """
+        conn = sqlite3.connect(self.db, timeout=60, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init(self):
+        """
+        Create the revisions table, importing revisions.txt on first use.
+        """
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS revisions ('
+                'number INTEGER PRIMARY KEY, '
+                'revision TEXT NOT NULL UNIQUE, '
+                'commit_sha TEXT, '
+                'timestamp TEXT, '
+                'artifact TEXT)'
+            )
+
+            # Import the legacy revisions file into an empty store
+            if not conn.execute('SELECT 1 FROM revisions LIMIT 1').fetchone() and path.isfile(self.legacy):
+                with open(self.legacy, 'r') as f:
+                    for line in f:
+                        match = LEGACY_LINE.match(line.rstrip())
+                        if match:
+                            conn.execute('INSERT OR IGNORE INTO revisions (number, revision, timestamp) VALUES (?, ?, ?)', (
+                                int(match.group(2)), '{0}{1}'.format(match.group(1), match.group(2)), match.group(3)
+                            ))
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+
+    def allocate(self, commit=None, timestamp=None):
+        """
+        Allocate and record the next revision.
+
+        :param    commit: The commit SHA being built
+        :type     commit: str
+        :param timestamp: The build timestamp
+        :type  timestamp: str
+        :rtype: str
+        """
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            last     = conn.execute('SELECT MAX(number) FROM revisions').fetchone()[0]
+            number   = 0 if last is None else last + 1
+            revision = '{0}{1}'.format(self.prefix, number)
+            conn.execute('INSERT INTO revisions (number, revision, commit_sha, timestamp) VALUES (?, ?, ?, ?)', (
+                number, revision, commit, timestamp
+            ))
+            conn.execute('COMMIT')
+            return revision
+        finally:
+            conn.close()
+
+    def set_artifact(self, revision, artifact):
+        """
+        Record the package built for a revision.
+
+        :param revision: The revision string
+        :type  revision: str
+        :param artifact: The path to the built package
+        :type  artifact: str
+        """
+        conn = self._connect()
+        try:
+            conn.execute('UPDATE revisions SET artifact = ? WHERE revision = ?', (artifact, revision))
+        finally:
+            conn.close()
+
+    def set_commit(self, revision, commit):
+        """
+        Record the commit a revision is built from.
+
+        :param revision: The revision string
+        :type  revision: str
+        :param   commit: The commit SHA
+        :type    commit: str
+        """
+        conn = self._connect()
+        try:
+            conn.execute('UPDATE revisions SET commit_sha = ? WHERE revision = ?', (commit, revision))
+        finally:
+            conn.close()
+
+    def get(self, revision):
+        """
+        Return a single revision.
+
+        :param revision: The revision string
+        :type  revision: str
+        :rtype: dict|None
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT * FROM revisions WHERE revision = ?', (revision,)).fetchone()
+            return None if not row else dict(row)
+        finally:
+            conn.close()
+
+    def latest(self):
+        """
+        Return the most recent revision.
+
+        :rtype: dict|None
+        """
+        history = self.history(1)
+        return None if not history else history[0]
+
+    def history(self, limit=None):
+        """
+        Return revisions, newest first.
+
+        :param limit: The maximum number of revisions to return
+        :type  limit: int
+        :rtype: list
+        """
+        conn = self._connect()
+        try:
+            query = 'SELECT * FROM revisions ORDER BY number DESC'
+            if limit:
+                return [dict(r) for r in conn.execute('{0} LIMIT ?'.format(query), (limit,))]
+            return [dict(r) for r in conn.execute(query)]
+        finally:
+            conn.close()
@@ -0,0 +1,144 @@
+from threading import Thread, Condition
+from feedback import Feedback
+
+class DevToolsScheduler(object):
+    """
+    Run project jobs on a pool of worker threads, respecting dependencies.
+    """
+    def __init__(self, jobs=1):
+        """
+        :param jobs: The number of worker threads
+        :type  jobs: int
+        """
+        self.jobs     = max(1, int(jobs or 1))
+        self.feedback = Feedback()
+
+        # Jobs in insertion order / job definitions
+        self._order   = []
+        self._tasks   = {}
+
+        # Finished jobs / running jobs / shared condition
+        self._status  = {}
+        self._running = set()
+        self._cond    = Condition()
+
+    def add(self, key, func, args=(), depends=None):
+        """
+        Add a job to the scheduler.
+
+        :param     key: The job key (project name)
+        :type      key: str
+        :param    func: The callable to run
+        :type     func: callable
+        :param    args: Positional arguments for the callable
+        :type     args: tuple
+        :param depends: Keys of jobs that must succeed first
+        :type  depends: list
+        """
+        if not key in self._tasks:
+            self._order.append(key)
+        self._tasks[key] = (func, args, list(depends or []))
+
+    def _depends(self, key):
+        """
+        Return the dependencies of a job that are scheduled in this run.
+
+        :rtype: list
+        """
+        return [d for d in self._tasks[key][2] if d in self._tasks and not d == key]
+
+    def _next(self):
+        """
+        Find the next runnable job. Jobs whose dependencies failed are
+        marked as failed without being run. Must be called with the
+        condition held.
+
+        :rtype: str|None
+        """
+        for key in self._order:
+            if key in self._status or key in self._running:
+                continue
+            depends = self._depends(key)
+
+            # A dependency failed, skip this job
+            failed = [d for d in depends if self._status.get(d) is False]
+            if failed:
+                self.feedback.error('Skipping <{0}>, failed dependencies: {1}'.format(key, ', '.join(failed)))
+                self._status[key] = False
+                self._cond.notify_all()
+                return self._next()
+
+            # All dependencies finished successfully
+            if all(d in self._status for d in depends):
+                return key
+        return None
+
+    def _pending(self):
+        """
+        Return a list of jobs not yet started. Must be called with the
+        condition held.
+
+        :rtype: list
+        """
+        return [k for k in self._order if not k in self._status and not k in self._running]
+
+    def _worker(self):
+        """
+        Worker thread loop.
+        """
+        while True:
+            with self._cond:
+                key = self._next()
+                while key is None:
+                    pending = self._pending()
+
+                    # Nothing left to do
+                    if not pending:
+                        return
+
+                    # Nothing running and nothing runnable, dependency cycle
+                    if not self._running:
+                        for k in pending:
+                            self.feedback.error('Skipping <{0}>, unresolvable dependencies'.format(k))
+                            self._status[k] = False
+                        self._cond.notify_all()
+                        return
+                    self._cond.wait()
+                    key = self._next()
+                self._running.add(key)
+
+            # Run the job outside of the lock
+            func, args, depends = self._tasks[key]
+            try:
+                status = False if func(*args) is False else True
+            except (SystemExit, Exception) as e:
+                self.feedback.error('Job <{0}> failed: {1}'.format(key, str(e)))
+                status = False
+
+            # Record the result and wake up waiting workers
+            with self._cond:
+                self._running.discard(key)
+                self._status[key] = status
+                self._cond.notify_all()
+
+    def run(self):
+        """
+        Run all jobs and return a dict of job/status key pairs.
+
+        :rtype: dict
+        """
+        if self.jobs == 1:
+            self._worker()
+            return self._status
+
+        # Start the worker pool
+        workers = [Thread(target=self._worker) for i in range(min(self.jobs, len(self._order)))]
+        for w in workers:
+            w.daemon = True
+            w.start()
+
+        # Wait for all workers
+        for w in workers:
+            while w.is_alive():
+                w.join(1)
+        return self._status
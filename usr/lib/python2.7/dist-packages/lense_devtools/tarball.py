@@ -0,0 +1,177 @@
+import zlib
+import tarfile
+from time import time
+from struct import pack
+from collections import deque
+from subprocess import Popen, PIPE
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from distutils.spawn import find_executable
+from os import path
+
+# Supported compression formats / tarball extensions
+COMPRESSION = {
+    'gz': 'gz',
+    'xz': 'xz'
+}
+
+def _deflate(data, level, final):
+    """
+    Compress a chunk as part of a raw deflate stream. Non-final chunks end
+    on a byte boundary (sync flush) so compressed chunks can be concatenated.
+
+    :rtype: str
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+class ParallelGzipFile(object):
+    """
+    Write-only file object producing a single gzip member, compressing
+    fixed size chunks on a thread pool in the style of pigz.
+    """
+    def __init__(self, fileobj, threads=1, level=6, chunk_size=131072):
+        """
+        :param    fileobj: The file object to write compressed data to
+        :type     fileobj: file
+        :param    threads: The number of compression threads
+        :type     threads: int
+        :param      level: The compression level
+        :type       level: int
+        :param chunk_size: The size of each independently compressed chunk
+        :type  chunk_size: int
+        """
+        self.fileobj    = fileobj
+        self.level      = level
+        self.chunk_size = chunk_size
+
+        # Compression pool / pending chunks / input buffer
+        self._pool      = ThreadPool(threads)
+        self._maxq      = threads * 2
+        self._pending   = deque()
+        self._buffer    = []
+        self._buffered  = 0
+
+        # Checksum / uncompressed size
+        self._crc       = zlib.crc32('') & 0xffffffff
+        self._size      = 0
+
+        # Gzip header (no flags, Unix)
+        self.fileobj.write('\x1f\x8b\x08\x00' + pack('<L', int(time())) + '\x00\x03')
+
+    def _drain(self, limit):
+        """
+        Write compressed chunks in order until at most limit are pending.
+        """
+        while len(self._pending) > limit:
+            self.fileobj.write(self._pending.popleft().get())
+
+    def _submit(self, final=False):
+        """
+        Queue the buffered input for compression.
+        """
+        data = ''.join(self._buffer)
+        self._buffer, self._buffered = [], 0
+
+        # Checksum is computed sequentially in input order
+        self._crc   = zlib.crc32(data, self._crc) & 0xffffffff
+        self._size += len(data)
+        self._pending.append(self._pool.apply_async(_deflate, (data, self.level, final)))
+        self._drain(self._maxq)
+
+    def write(self, data):
+        """
+        Buffer data, compressing each full chunk.
+        """
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered >= self.chunk_size:
+            self._submit()
+
+    def close(self):
+        """
+        Compress the final chunk and write the gzip trailer.
+        """
+        self._submit(final=True)
+        self._drain(0)
+        self._pool.close()
+        self._pool.join()
+        self.fileobj.write(pack('<LL', self._crc, self._size & 0xffffffff))
+
+class DevToolsTarball(object):
+    """
+    Create source tarballs, streaming files into a multi-threaded compressor.
+    """
+    def __init__(self, compression='gz', threads=0, level=6):
+        """
+        :param compression: The compression format (gz, xz)
+        :type  compression: str
+        :param     threads: Compression threads, 0 for one per CPU
+        :type      threads: int
+        :param       level: The compression level
+        :type        level: int
+        """
+        if not compression in COMPRESSION:
+            raise Exception('Unsupported tarball compression <{0}>, must be one of: {1}'.format(compression, ', '.join(COMPRESSION.keys())))
+
+        self.compression = compression
+        self.threads     = int(threads) or cpu_count()
+        self.level       = int(level)
+
+    @property
+    def extension(self):
+        """
+        Return the tarball file extension.
+
+        :rtype: str
+        """
+        return 'tar.{0}'.format(COMPRESSION[self.compression])
+
+    def _external(self):
+        """
+        Return the command for an external compressor if one is available.
+
+        :rtype: list|None
+        """
+        if self.compression == 'xz':
+            if not find_executable('xz'):
+                raise Exception('Compression <xz> requires the "xz" command')
+            return ['xz', '-T{0}'.format(self.threads), '-{0}'.format(self.level), '-c']
+        if find_executable('pigz'):
+            return ['pigz', '-p', str(self.threads), '-{0}'.format(self.level), '-c']
+        return None
+
+    def create(self, tarball, source, basedir):
+        """
+        Create a tarball from a source directory.
+
+        :param tarball: The tarball path, relative to basedir
+        :type  tarball: str
+        :param  source: The source directory, relative to basedir
+        :type   source: str
+        :param basedir: The base directory for tarball and source
+        :type  basedir: str
+        :rtype: str
+        """
+        tarpath  = path.join(basedir, tarball)
+        srcpath  = path.join(basedir, source)
+        external = self._external()
+
+        with open(tarpath, 'wb') as out:
+
+            # Stream the archive through an external compressor
+            if external:
+                proc = Popen(external, stdin=PIPE, stdout=out)
+                with tarfile.open(fileobj=proc.stdin, mode='w|') as tar:
+                    tar.add(srcpath, arcname=source)
+                proc.stdin.close()
+                if not proc.wait() == 0:
+                    raise Exception('Compressor <{0}> exited with code: {1}'.format(external[0], proc.returncode))
+
+            # Stream the archive through the built in parallel gzip writer
+            else:
+                gz = ParallelGzipFile(out, threads=self.threads, level=self.level)
+                with tarfile.open(fileobj=gz, mode='w|') as tar:
+                    tar.add(srcpath, arcname=source)
+                gz.close()
+        return tarpath
@@ -0,0 +1,150 @@
+from errno import EEXIST
+from os import times, open as os_open, fdopen, O_WRONLY, O_CREAT, O_EXCL
+from functools import wraps
+from itertools import count
+from threading import Lock
+from datetime import datetime
+from time import time as walltime
+from contextlib import contextmanager
+from json import dumps as json_dumps
+from resource import getrusage, RUSAGE_CHILDREN
+
+def _write_bytes():
+    """
+    Bytes written to storage by this process and its reaped children.
+
+    :rtype: int|None
+    """
+    try:
+        with open('/proc/self/io', 'r') as f:
+            for line in f:
+                if line.startswith('write_bytes:'):
+                    return int(line.split()[1])
+    except (IOError, ValueError):
+        pass
+    return None
+
+def _sample():
+    """
+    Take a sample of the process counters.
+
+    :rtype: tuple
+    """
+    t = times()
+    return walltime(), t[0] + t[1] + t[2] + t[3], _write_bytes(), t[2] + t[3]
+
+class DevToolsTimer(object):
+    """
+    Process wide recorder of per project build phase timings. CPU time and
+    bytes written are process wide counters and overlap when several
+    projects are built in parallel. The child RSS is the running maximum of
+    every child reaped so far, only recorded for phases that reaped one.
+    """
+
+    # Recorded phases / record lock / run start time
+    _records = []
+    _lock    = Lock()
+    _started = datetime.now()
+
+    @classmethod
+    @contextmanager
+    def phase(cls, project, name):
+        """
+        Record the duration of a phase.
+
+        :param project: The project name
+        :type  project: str
+        :param    name: The phase name
+        :type     name: str
+        """
+        wall, cpu, written, children = _sample()
+        record = {'project': project, 'phase': name, 'ok': False}
+        try:
+            yield record
+            record['ok'] = True
+        finally:
+            end_wall, end_cpu, end_written, end_children = _sample()
+            record.update({
+                'wall':                       round(end_wall - wall, 4),
+                'cpu':                        round(end_cpu - cpu, 4),
+                'children_maxrss_running_kb': None if end_children == children else getrusage(RUSAGE_CHILDREN).ru_maxrss,
+                'write_bytes':                None if written is None or end_written is None else end_written - written
+            })
+            with cls._lock:
+                cls._records.append(record)
+
+    @classmethod
+    def records(cls):
+        """
+        Return a copy of all recorded phases.
+
+        :rtype: list
+        """
+        with cls._lock:
+            return list(cls._records)
+
+    @classmethod
+    def reset(cls):
+        """
+        Clear all recorded phases and start a new run.
+        """
+        with cls._lock:
+            cls._records = []
+            cls._started = datetime.now()
+
+    @classmethod
+    def table(cls):
+        """
+        Return timing table lines, one per project and phase.
+
+        :rtype: list
+        """
+        lines = ['{0:<16} {1:<16} {2:>9} {3:>9} {4:>12}'.format('PROJECT', 'PHASE', 'WALL (s)', 'CPU (s)', 'WRITTEN (KB)')]
+        for r in sorted(cls.records(), key=lambda r: (r['project'], r['phase'])):
+            written = '-' if r['write_bytes'] is None else r['write_bytes'] / 1024
+            lines.append('{0:<16} {1:<16} {2:>9.2f} {3:>9.2f} {4:>12}'.format(r['project'], r['phase'], r['wall'], r['cpu'], written))
+        return lines
+
+    @classmethod
+    def report(cls, workspace, command):
+        """
+        Write a JSON report of the run into the workspace.
+
+        :param workspace: The workspace path
+        :type  workspace: str
+        :param   command: The command that was run
+        :type    command: str
+        :rtype: str
+        """
+        # Never overwrite the report of another run started at the same time
+        stamp = '{0}/reports/{1}-{2}'.format(workspace, command, cls._started.strftime('%Y%m%d-%H%M%S-%f'))
+        for n in count():
+            report = '{0}.json'.format(stamp) if not n else '{0}-{1}.json'.format(stamp, n)
+            try:
+                fd = os_open(report, O_WRONLY | O_CREAT | O_EXCL, 0644)
+                break
+            except OSError as e:
+                if not e.errno == EEXIST:
+                    raise
+        with fdopen(fd, 'w') as f:
+            f.write(json_dumps({
+                'command': command,
+                'started': cls._started.isoformat(),
+                'phases':  cls.records()
+            }, indent=2))
+        return report
+
+def timed(name):
+    """
+    Decorator recording a method as a phase of the instance's build target.
+
+    :param name: The phase name
+    :type  name: str
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with DevToolsTimer.phase(getattr(self, 'label', self.name), name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,201 @@
+import sqlite3
+from hashlib import sha1
+from os import path, walk, lstat, readlink
+from stat import S_ISLNK, S_ISREG
+
+# Directories not part of the packaged tree (git metadata, applied quilt patches)
+IGNORED_DIRS = ['.git', '.pc']
+
+class DevToolsTreeIndex(object):
+    """
+    Persisted index of the files in a project source tree, stored in an
+    sqlite database in the project root. Only files whose stat changed are
+    rehashed when the tree is scanned.
+    """
+    def __init__(self, root, src):
+        """
+        :param root: The project root directory
+        :type  root: str
+        :param  src: The project source directory
+        :type   src: str
+        """
+        self.root = root
+        self.src  = src
+        self.db   = '{0}/treeindex.db'.format(root)
+
+        # Create the schema
+        self._init()
+
+    def _connect(self):
+        """
+        Open a connection in autocommit mode, transactions are explicit.
+
+        :rtype: sqlite3.Connection
+        """
+        conn = sqlite3.connect(self.db, timeout=60, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init(self):
+        """
+        Create the file index and tree state tables.
+        """
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS files ('
+                'path TEXT PRIMARY KEY, '
+                'size INTEGER, '
+                'mtime REAL, '
+                'inode INTEGER, '
+                'hash TEXT)'
+            )
+            conn.execute('CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)')
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+
+    def _hash(self, fpath, st):
+        """
+        Hash a file's contents, or its target for symbolic links.
+
+        :param fpath: The file path
+        :type  fpath: str
+        :param    st: The file stat
+        :type     st: posix.stat_result
+        :rtype: str
+        """
+        digest = sha1()
+        if S_ISLNK(st.st_mode):
+            digest.update('link:{0}'.format(readlink(fpath)))
+            return digest.hexdigest()
+        with open(fpath, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _files(self):
+        """
+        Yield the relative path and stat of every file in the source tree.
+
+        :rtype: generator
+        """
+        for root, dirs, files in walk(self.src):
+            dirs[:] = [d for d in dirs if not d in IGNORED_DIRS]
+            for f in files:
+                fpath = path.join(root, f)
+                try:
+                    st = lstat(fpath)
+                except OSError:
+                    continue
+                if S_ISREG(st.st_mode) or S_ISLNK(st.st_mode):
+                    yield path.relpath(fpath, self.src), fpath, st
+
+    def scan(self):
+        """
+        Update the index from the source tree and return the tree digest.
+
+        :rtype: str
+        """
+        conn = self._connect()
+        try:
+            indexed = dict((r['path'], r) for r in conn.execute('SELECT * FROM files'))
+            changed = []
+            hashes  = {}
+            for rel, fpath, st in self._files():
+                row = indexed.pop(rel, None)
+
+                # Stat unchanged, reuse the indexed hash
+                if row and row['size'] == st.st_size and row['mtime'] == st.st_mtime and row['inode'] == st.st_ino:
+                    hashes[rel] = row['hash']
+                    continue
+                hashes[rel] = self._hash(fpath, st)
+                changed.append((rel, st.st_size, st.st_mtime, st.st_ino, hashes[rel]))
+
+            # Write back changed and removed files in one transaction
+            if changed or indexed:
+                conn.execute('BEGIN IMMEDIATE')
+                conn.executemany('INSERT OR REPLACE INTO files (path, size, mtime, inode, hash) VALUES (?, ?, ?, ?, ?)', changed)
+                conn.executemany('DELETE FROM files WHERE path = ?', [(p,) for p in indexed])
+                conn.execute('COMMIT')
+        finally:
+            conn.close()
+
+        # Digest of the whole tree from the per file hashes
+        digest = sha1()
+        for rel in sorted(hashes):
+            digest.update('{0}\0{1}\n'.format(rel, hashes[rel]))
+        return digest.hexdigest()
+
+    def _get(self, key):
+        """
+        Return a tree state value.
+
+        :param key: The state key
+        :type  key: str
+        :rtype: str|None
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT value FROM state WHERE key = ?', (key,)).fetchone()
+            return None if not row else row['value']
+        finally:
+            conn.close()
+
+    def _set(self, key, value):
+        """
+        Store a tree state value.
+
+        :param   key: The state key
+        :type    key: str
+        :param value: The state value
+        :type  value: str
+        """
+        conn = self._connect()
+        try:
+            conn.execute('INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)', (key, value))
+        finally:
+            conn.close()
+
+    def changed(self, commit=None):
+        """
+        Check if the source tree differs from the last built tree. A tree
+        without a recorded build is taken as built at <commit>.
+
+        :param commit: The commit SHA the tree is checked out at
+        :type  commit: str
+        :rtype: bool
+        """
+        digest = self.scan()
+        built  = self._get('built')
+        if built is None:
+            self.mark_built(commit, digest)
+            return False
+        return not digest == built
+
+    def status(self, commit):
+        """
+        Check if the source tree moved since the last build and if it holds
+        uncommitted local edits, from a single scan. Edits are changes while
+        still on the commit that was built. Trees moved by git (merges, local
+        commits) are not edits, the commit identifies them.
+
+        :param commit: The commit SHA the tree is checked out at
+        :type  commit: str
+        :rtype: tuple
+        """
+        moved = self.changed(commit)
+        return moved, moved and self._get('commit') in [None, commit]
+
+    def mark_built(self, commit=None, digest=None):
+        """
+        Record the current source tree as the last built tree.
+
+        :param commit: The commit SHA the tree was built from
+        :type  commit: str
+        :param digest: The tree digest, scanned if not given
+        :type  digest: str
+        """
+        self._set('built', digest or self.scan())
+        self._set('commit', commit)
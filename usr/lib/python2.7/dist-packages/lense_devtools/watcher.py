@@ -0,0 +1,122 @@
+from time import time, sleep
+from multiprocessing.pool import ThreadPool
+from lense_devtools.common import DevToolsCommon
+from lense_devtools.gitrepo import DevToolsGitRepo
+
+class DevToolsWatchState(object):
+    """
+    Polling state for a single project.
+    """
+    def __init__(self, gitrepo, interval):
+        """
+        :param  gitrepo: The project repository handler
+        :type   gitrepo: DevToolsGitRepo
+        :param interval: The initial polling interval in seconds
+        :type  interval: int
+        """
+        self.gitrepo  = gitrepo
+
+        # Last seen remote head (starts at the local head) / polling interval / next check
+        self.head     = gitrepo.local_head()
+        self.interval = interval
+        self.due      = 0
+
+        # When a pending change settles
+        self.settle   = None
+
+class DevToolsWatcher(DevToolsCommon):
+    """
+    Poll project remotes and trigger builds for branches that moved.
+    """
+    def __init__(self, targets, trigger):
+        """
+        :param targets: The (key, project, branch) build targets to watch
+        :type  targets: list
+        :param trigger: Called with a list of projects to build
+        :type  trigger: callable
+        """
+        super(DevToolsWatcher, self).__init__()
+
+        # Polling interval / maximum idle interval / seconds to coalesce pushes
+        settings          = self.config.get('WATCH', {})
+        self.interval     = int(settings.get('interval', 60))
+        self.max_interval = int(settings.get('max-interval', 900))
+        self.settle       = int(settings.get('settle', 30))
+
+        # Build trigger / target states
+        self.trigger      = trigger
+        self.states       = dict((k, DevToolsWatchState(DevToolsGitRepo(p, self.projects[p], branch=b), self.interval)) for k,p,b in targets)
+
+    def _poll(self, key):
+        """
+        Query the remote head of a build target.
+
+        :rtype: tuple
+        """
+        return key, self.states[key].gitrepo.ls_remote()
+
+    def _check(self, pool, now):
+        """
+        Check every due project, resetting the interval of projects that
+        moved and backing off idle ones.
+        """
+        due = [p for p,s in self.states.iteritems() if s.due <= now]
+        for project, head in pool.map(self._poll, due):
+            state = self.states[project]
+
+            # Remote could not be queried, retry later
+            if not head:
+                self.feedback.error('Failed to query remote for <{0}>'.format(project))
+                state.interval = min(state.interval * 2, self.max_interval)
+
+            # Branch moved, wait for further pushes to settle
+            elif not head == state.head:
+                self.feedback.info('Remote <{0}> moved: {1} -> {2}'.format(project, (state.head or 'none')[:8], head[:8]))
+                state.head     = head
+                state.interval = self.interval
+                state.settle   = now + self.settle
+
+            # Idle, back off
+            else:
+                state.interval = min(state.interval * 2, self.max_interval)
+            state.due = now + (state.interval if not state.settle else min(state.interval, self.settle))
+
+    def _settled(self, now):
+        """
+        Return and clear the projects with targets whose changes have settled.
+
+        :rtype: list
+        """
+        ready = set()
+        for state in self.states.values():
+            if state.settle and state.settle <= now:
+                state.settle = None
+                ready.add(state.gitrepo.name)
+        return sorted(ready)
+
+    def run(self):
+        """
+        Watch the remotes until interrupted.
+        """
+        pool = ThreadPool(self.git_pool_size(len(self.states)))
+        self.feedback.info('Watching {0} targets (interval {1}s, max {2}s, settle {3}s)'.format(len(self.states), self.interval, self.max_interval, self.settle))
+        try:
+            while True:
+                self._check(pool, time())
+
+                # Trigger one build for everything that settled
+                ready = self._settled(time())
+                if ready:
+                    self.feedback.success('Triggering build: {0}'.format(', '.join(ready)))
+                    try:
+                        self.trigger(ready)
+                    except (SystemExit, Exception) as e:
+                        self.feedback.error('Triggered build failed: {0}'.format(str(e)))
+
+                # Sleep until the next check or settle deadline
+                deadlines = [s.due for s in self.states.values()] + [s.settle for s in self.states.values() if s.settle]
+                sleep(max(1, min(deadlines) - time()))
+        except KeyboardInterrupt:
+            self.feedback.info('Stopped watching')
+        finally:
+            pool.close()